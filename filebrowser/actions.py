@@ -1,11 +1,13 @@
 import os
-import tempfile
 
 from django.contrib import messages
 from django.core.files import File
 from django.utils.translation import gettext_lazy as _
 
+from filebrowser.base import forget_fileobject
 from filebrowser.settings import VERSION_QUALITY, STRICT_PIL
+from filebrowser.utils import EncodeBuffer, auto_orient
+from filebrowser.sources import open_source
 
 if STRICT_PIL:
     from PIL import Image
@@ -21,32 +23,54 @@ def applies_to_all_images(fileobject):
     return fileobject.filetype == 'Image'
 
 
+def _save_image(fileobject, im, **kwargs):
+    "Encode an image in the format of fileobject and write it over the original"
+    root, ext = os.path.splitext(fileobject.filename)
+    buf = EncodeBuffer()
+
+    try:
+        im.save(buf, format=Image.EXTENSION[ext.lower()], quality=VERSION_QUALITY, optimize=(ext.lower() != '.gif'), **kwargs)
+    except IOError:
+        im.save(buf, format=Image.EXTENSION[ext.lower()], quality=VERSION_QUALITY, **kwargs)
+
+    fileobject.site.storage.replace(fileobject.path, File(buf))
+    buf.close()
+    fileobject.delete_versions()
+    forget_fileobject(fileobject.path, site=fileobject.site)
+
+
 def transpose_image(request, fileobjects, operation):
     "Transpose image"
     for fileobject in fileobjects:
-        root, ext = os.path.splitext(fileobject.filename)
-        f = fileobject.site.storage.open(fileobject.path)
-        im = Image.open(f)
-        new_image = im.transpose(operation)
-        tmpfile = File(tempfile.NamedTemporaryFile())
-
+        f = open_source(fileobject)
         try:
-            new_image.save(tmpfile, format=Image.EXTENSION[ext], quality=VERSION_QUALITY, optimize=(os.path.splitext(fileobject.path)[1].lower() != '.gif'))
-        except IOError:
-            new_image.save(tmpfile, format=Image.EXTENSION[ext], quality=VERSION_QUALITY)
-
-        try:
-            saved_under = fileobject.site.storage.save(fileobject.path, tmpfile)
-            if saved_under != fileobject.path:
-                fileobject.site.storage.move(saved_under, fileobject.path, allow_overwrite=True)
-            fileobject.delete_versions()
+            im = Image.open(f)
+            new_image = im.transpose(operation)
+            _save_image(fileobject, new_image)
         finally:
-            tmpfile.close()
             f.close()
 
         messages.add_message(request, messages.SUCCESS, _("Action applied successfully to '%s'" % (fileobject.filename)))
 
 
+def auto_orient_image(fileobject):
+    """
+    Rotate/flip an image according to its EXIF orientation tag.
+
+    Returns True if the original has been rewritten.
+    """
+    f = open_source(fileobject)
+    try:
+        im = Image.open(f)
+        new_image = auto_orient(im)
+        if new_image is im:
+            return False
+        _save_image(fileobject, new_image, exif=new_image.getexif())
+    finally:
+        f.close()
+    return True
+
+
 def flip_horizontal(request, fileobjects):
     "Flip image horizontally"
     transpose_image(request, fileobjects, 0)
@@ -1,20 +1,39 @@
+import concurrent.futures
+import contextlib
+import contextvars
+import copy
 import datetime
 import mimetypes
 import os
 import platform
-import tempfile
 import time
+import types
 
 from django.core.files import File
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.utils.encoding import force_str
 from django.utils.functional import cached_property
 from filebrowser.settings import (ADMIN_VERSIONS, DEFAULT_PERMISSIONS,
-                                  EXTENSIONS, IMAGE_MAXBLOCK, SELECT_FORMATS,
-                                  STRICT_PIL, VERSION_QUALITY, VERSIONS,
-                                  VERSIONS_BASEDIR)
-from filebrowser.utils import get_modified_time, path_strip, process_image
-
-from .namers import get_namer
+                                  EXTENSIONS, IMAGE_MAXBLOCK, LQIP, LQIP_SIZE,
+                                  PREFETCH_TIMEOUT, SELECT_FORMATS, STRICT_PIL,
+                                  VERSION_ANALYZERS, VERSION_CASCADE,
+                                  VERSION_CASCADE_MIN_RATIO,
+                                  VERSION_LOCK_TIMEOUT, VERSION_MANIFEST,
+                                  VERSION_MAX_PIXELS, VERSION_QUALITY,
+                                  VERSION_WORKERS, VERSIONS, VERSIONS_BASEDIR)
+from filebrowser.utils import (ANALYZE_SIZE, EncodeBuffer, analyze_image,
+                               fit_pixel_budget, get_extension_format,
+                               get_lqip, get_modified_time, get_required_size,
+                               path_strip, process_image,
+                               processors_are_builtin, processors_are_pure)
+
+from . import manifest, metrics, workers
+from .metadata import delete_metadata, get_metadata, set_metadata
+from .namers import get_namer, get_version_name
+from .profiling import stage
+from .sprites import delete_sprites
+from .sources import open_source
 
 if STRICT_PIL:
     from PIL import Image
@@ -30,6 +49,80 @@ else:
 
 ImageFile.MAXBLOCK = IMAGE_MAXBLOCK  # default is 64k
 
+# Keys of PIL's Image.info with metadata of an original (not copied to versions)
+ORIGINAL_METADATA_KEYS = ('exif', 'xmp', 'XML:com.adobe.xmp', 'photoshop', 'comment', 'icc_profile')
+
+# version_suffix -> (copy of the VERSIONS entry, read-only options), see FileObject._get_options
+_version_options = {}
+
+# FileObjects shared within the current context (e.g. a request), see get_fileobject
+_fileobjects = contextvars.ContextVar('filebrowser_fileobjects', default=None)
+
+
+@contextlib.contextmanager
+def fileobject_registry():
+    """
+    Within this context, get_fileobject returns the same FileObject
+    for the same path (and site). The cached properties (exists, filesize,
+    date, dimensions, ...) are therefore shared by decorators, views and
+    templates.
+    """
+    if _fileobjects.get() is not None:
+        yield
+        return
+    token = _fileobjects.set({})
+    try:
+        yield
+    finally:
+        _fileobjects.reset(token)
+
+
+def get_fileobject(path, site=None):
+    """
+    Returns a FileObject for path. With an active fileobject_registry,
+    the same FileObject is returned for the same path.
+    """
+    registry = _fileobjects.get()
+    if registry is None:
+        return FileObject(path, site=site)
+    if not site:
+        from filebrowser.sites import site as default_site
+        site = default_site
+    key = (site, path)
+    if key not in registry:
+        registry[key] = FileObject(path, site=site)
+    return registry[key]
+
+
+def forget_fileobject(path, site=None):
+    """
+    Remove a FileObject from the active fileobject_registry, e.g. if the file
+    has been changed or deleted.
+    """
+    registry = _fileobjects.get()
+    if registry is None:
+        return
+    if not site:
+        from filebrowser.sites import site as default_site
+        site = default_site
+    registry.pop((site, path), None)
+
+
+@receiver(setting_changed)
+def _reset_version_options(setting, **kwargs):
+    "Options of the versions are built again if a setting changes (e.g. with override_settings)"
+    if setting.startswith('FILEBROWSER_'):
+        _version_options.clear()
+
+
+def _prefetch(fileobject, attrs):
+    "Resolves (caches) attrs of fileobject, errors are raised again when the attribute is accessed"
+    for attr in attrs:
+        try:
+            getattr(fileobject, attr)
+        except Exception:
+            pass
+
 
 class FileListing():
     """
@@ -82,14 +175,40 @@ class FileListing():
             attr = (attr, )
         return sorted(seq, key=attrgetter(*attr))
 
+    def prefetch(self, fileobjects, attrs=('date', 'filesize', 'dimensions'), timeout=None):
+        """
+        Resolves attrs of fileobjects concurrently with the thread pool of the
+        site (see PREFETCH_WORKERS), waiting at most timeout seconds (defaults
+        to PREFETCH_TIMEOUT). Attributes which are not resolved in time are
+        resolved when accessed. Returns fileobjects.
+        """
+        executor = getattr(self.site, 'prefetch_executor', None)
+        if executor is None:
+            return fileobjects
+        if isinstance(attrs, str):
+            attrs = (attrs, )
+        futures = [
+            # every task runs with a copy of the current context (e.g. for profiling)
+            executor.submit(contextvars.copy_context().run, _prefetch, fileobject, attrs)
+            for fileobject in fileobjects
+            if not all(attr in fileobject.__dict__ for attr in attrs)
+        ]
+        if futures:
+            done, not_done = concurrent.futures.wait(futures, timeout=PREFETCH_TIMEOUT if timeout is None else timeout)
+            for future in not_done:
+                future.cancel()
+        return fileobjects
+
     @cached_property
     def is_folder(self):
-        return self.site.storage.isdir(self.path)
+        return get_fileobject(self.path, site=self.site).is_folder
 
     def listing(self):
         "List all files for path"
         if self.is_folder:
-            dirs, files = self.site.storage.listdir(self.path)
+            with metrics.timer('listing_seconds'):
+                dirs, files = self.site.storage.listdir(self.path)
+            metrics.observe('listing_files', len(dirs) + len(files))
             return (f for f in dirs + files)
         return []
 
@@ -116,7 +235,9 @@ class FileListing():
         "Walk all files for path"
         filelisting = []
         if self.is_folder:
-            self._walk(self.path, filelisting)
+            with metrics.timer('listing_seconds', walk=True):
+                self._walk(self.path, filelisting)
+            metrics.observe('listing_files', len(filelisting), walk=True)
         return filelisting
 
     # Cached results of files_listing_total (without any filters and sorting applied)
@@ -127,12 +248,13 @@ class FileListing():
         if self._fileobjects_total is None:
             self._fileobjects_total = []
             for item in self.listing():
-                fileobject = FileObject(os.path.join(self.path, item), site=self.site)
+                fileobject = get_fileobject(os.path.join(self.path, item), site=self.site)
                 self._fileobjects_total.append(fileobject)
 
         files = self._fileobjects_total
 
         if self.sorting_by:
+            self.prefetch(files, self.sorting_by)
             files = self.sort_by_attr(files, self.sorting_by)
         if self.sorting_order == "desc":
             files.reverse()
@@ -144,9 +266,10 @@ class FileListing():
         "Returns FileObjects for all files in walk"
         files = []
         for item in self.walk():
-            fileobject = FileObject(os.path.join(self.site.directory, item), site=self.site)
+            fileobject = get_fileobject(os.path.join(self.site.directory, item), site=self.site)
             files.append(fileobject)
         if self.sorting_by:
+            self.prefetch(files, self.sorting_by)
             files = self.sort_by_attr(files, self.sorting_by)
         if self.sorting_order == "desc":
             files.reverse()
@@ -246,6 +369,9 @@ class FileObject():
             for extension in v:
                 if self.extension.lower() == extension.lower():
                     file_type = k
+        # versions may be saved with another format (e.g. webp)
+        if not file_type and self.is_version and get_extension_format(self.extension):
+            file_type = 'Image'
         return file_type
 
     def _get_format_type(self):
@@ -279,18 +405,23 @@ class FileObject():
     @cached_property
     def filesize(self):
         "Filesize in bytes"
-        return self.site.storage.size(self.path) if self.exists else None
+        if not self.exists:
+            return None
+        if self.stat.size is not None:
+            return self.stat.size
+        return self.storage.size(self.path)
 
     @cached_property
     def date(self):
-        "Modified time (from site.storage) as float (mktime)"
+        "Modified time (from the storage) as float (mktime)"
         if self.exists:
-            return time.mktime(get_modified_time(self.site.storage, self.path).timetuple())
+            mtime = self.stat.mtime or get_modified_time(self.storage, self.path)
+            return time.mktime(mtime.timetuple())
         return None
 
     @property
     def datetime(self):
-        "Modified time (from site.storage) as datetime"
+        "Modified time (from the storage) as datetime"
         if self.date:
             return datetime.datetime.fromtimestamp(self.date)
         return None
@@ -298,7 +429,19 @@ class FileObject():
     @cached_property
     def exists(self):
         "True, if the path exists, False otherwise"
-        return self.site.storage.exists(self.path)
+        return self.stat.exists
+
+    @property
+    def storage(self):
+        "The storage of the file (site.versions_storage for versions within VERSIONS_BASEDIR)"
+        if VERSIONS_BASEDIR and self.is_version:
+            return self.site.versions_storage
+        return self.site.storage
+
+    @cached_property
+    def stat(self):
+        "Existence, kind and (if available) size/mtime/etag with one call to the storage"
+        return self.storage.stat(self.path)
 
     # PATH/URL ATTRIBUTES/PROPERTIES
     # path (see init)
@@ -314,8 +457,8 @@ class FileObject():
 
     @property
     def path_full(self):
-        "Absolute path as defined with site.storage"
-        return self.site.storage.path(self.path)
+        "Absolute path as defined with the storage"
+        return self.storage.path(self.path)
 
     @property
     def dirname(self):
@@ -324,8 +467,8 @@ class FileObject():
 
     @property
     def url(self):
-        "URL for the file/folder as defined with site.storage"
-        return self.site.storage.url(self.path)
+        "URL for the file/folder as defined with the storage"
+        return self.storage.url(self.path)
 
     # IMAGE ATTRIBUTES/PROPERTIES
     # dimensions
@@ -333,6 +476,10 @@ class FileObject():
     # height
     # aspectratio
     # orientation
+    # metadata
+    # lqip
+    # phash
+    # dominant_color
 
     @cached_property
     def dimensions(self):
@@ -340,8 +487,8 @@ class FileObject():
         if self.filetype != 'Image':
             return None
         try:
-            im = Image.open(self.site.storage.open(self.path))
-            return im.size
+            with open_source(self) as f:
+                return Image.open(f).size
         except:
             pass
 
@@ -376,6 +523,90 @@ class FileObject():
                 return "Portrait"
         return None
 
+    @cached_property
+    def metadata(self):
+        """
+        Metadata of an image from the metadata cache (see LQIP and
+        VERSION_ANALYZERS). Usually generated with the versions, otherwise
+        the original is opened once (with the same limit as versions, see
+        VERSION_MAX_PIXELS).
+        """
+        if self.filetype != 'Image':
+            return {}
+        metadata = get_metadata(self)
+        if self._missing_metadata(metadata) and self.exists:
+            size = max(LQIP_SIZE, ANALYZE_SIZE)
+            try:
+                f, im = self._open_original([{'width': size, 'height': size}])
+            except Exception:
+                return metadata
+            if im is None:
+                # not opened again (unless VERSION_MAX_PIXELS changes)
+                return set_metadata(self, refused=VERSION_MAX_PIXELS)
+            try:
+                metadata = self._update_metadata(im, metadata)
+            except Exception:
+                pass
+            finally:
+                f.close()
+        return metadata
+
+    def _missing_metadata(self, metadata):
+        return self._get_analysis(metadata) is not None
+
+    def _get_missing_analysis(self):
+        "What is missing within the metadata cache (see _get_analysis)"
+        if not (LQIP or VERSION_ANALYZERS):
+            return None
+        return self._get_analysis(get_metadata(self))
+
+    def _get_analysis(self, metadata):
+        """
+        What is missing within metadata: (LQIP size or None, analyzers),
+        None if nothing is missing (or the original exceeds VERSION_MAX_PIXELS).
+        """
+        if VERSION_MAX_PIXELS and metadata.get('refused') == VERSION_MAX_PIXELS:
+            return None
+        lqip_size = LQIP_SIZE if LQIP and 'lqip' not in metadata else None
+        analyzers = list(VERSION_ANALYZERS) if 'analyzed' not in metadata else []
+        if lqip_size is None and not analyzers:
+            return None
+        return lqip_size, analyzers
+
+    @staticmethod
+    def _analyze(im, analysis):
+        "Values of the metadata for analysis (see _get_analysis) of the original im"
+        lqip_size, analyzers = analysis
+        values = {}
+        if lqip_size:
+            values['lqip'] = get_lqip(im, lqip_size)
+        if analyzers:
+            values.update(analyze_image(im, analyzers))
+            values['analyzed'] = True
+        return values
+
+    def _update_metadata(self, im, metadata):
+        "Adds the missing LQIP/analysis of the (decoded) original im to the metadata cache"
+        analysis = self._get_analysis(metadata)
+        if analysis is not None:
+            metadata = set_metadata(self, **self._analyze(im, analysis))
+        return metadata
+
+    @property
+    def lqip(self):
+        "Tiny preview as data URI (see LQIP)"
+        return self.metadata.get('lqip')
+
+    @property
+    def phash(self):
+        "Perceptual hash (see VERSION_ANALYZERS)"
+        return self.metadata.get('phash')
+
+    @property
+    def dominant_color(self):
+        "Dominant color, e.g. '#87886d' (see VERSION_ANALYZERS)"
+        return self.metadata.get('dominant_color')
+
     # FOLDER ATTRIBUTES/PROPERTIES
     # is_folder
     # is_empty
@@ -383,13 +614,13 @@ class FileObject():
     @cached_property
     def is_folder(self):
         "True, if path is a folder"
-        return self.site.storage.isdir(self.path)
+        return self.stat.is_dir
 
     @property
     def is_empty(self):
         "True, if folder is empty. False otherwise, or if the object is not a folder."
         if self.is_folder:
-            dirs, files = self.site.storage.listdir(self.path)
+            dirs, files = self.storage.listdir(self.path)
             if not dirs and not files:
                 return True
         return False
@@ -420,7 +651,7 @@ class FileObject():
         "Returns the original FileObject"
         if self.is_version:
             relative_path = self.head.replace(self.versions_basedir, "").lstrip("/")
-            return FileObject(os.path.join(self.site.directory, relative_path, self.original_filename), site=self.site)
+            return get_fileobject(os.path.join(self.site.directory, relative_path, self.original_filename), site=self.site)
         return self
 
     @property
@@ -442,7 +673,24 @@ class FileObject():
     # version_generate(suffix)
 
     def _get_options(self, version_suffix, extra_options=None):
-        options = dict(VERSIONS.get(version_suffix, {}))
+        """
+        Options of a version. Without extra_options, the (read-only) options
+        are built once per version_suffix and built again when the entry of
+        VERSIONS changes (compared by value, so changing it in place is fine).
+        """
+        version = VERSIONS.get(version_suffix, {})
+        if not extra_options:
+            cached = _version_options.get(version_suffix)
+            if cached is None or cached[0] != version:
+                snapshot = copy.deepcopy(version)
+                cached = (snapshot, types.MappingProxyType(self._build_options(copy.deepcopy(snapshot))))
+                _version_options[version_suffix] = cached
+            return cached[1]
+        return self._build_options(version, extra_options)
+
+    @staticmethod
+    def _build_options(version, extra_options=None):
+        options = dict(version)
         if extra_options:
             options.update(extra_options)
         if 'size' in options and 'width' not in options:
@@ -469,14 +717,7 @@ class FileObject():
 
     def version_name(self, version_suffix, extra_options=None):
         "Name of a version"  # FIXME: version_name for version?
-        options = self._get_options(version_suffix, extra_options)
-        return get_namer(
-            file_object=self,
-            version_suffix=version_suffix,
-            filename_root=self.filename_root,
-            extension=self.extension,
-            options=options,
-        ).get_version_name()
+        return get_version_name(self, version_suffix, self._get_options(version_suffix, extra_options))
 
     def version_path(self, version_suffix, extra_options=None):
         "Path to a version (relative to storage location)"  # FIXME: version_path for version?
@@ -485,60 +726,340 @@ class FileObject():
             self.dirname,
             self.version_name(version_suffix, extra_options))
 
-    def version_generate(self, version_suffix, extra_options=None):
+    def version_fingerprint(self, version_suffix, extra_options=None):
+        "Fingerprint of the options of a version (recorded with VERSION_MANIFEST)"
+        return manifest.get_options_fingerprint(self._get_options(version_suffix, extra_options))
+
+    def version_exists(self, version_suffix, extra_options=None):
+        "True, if the version exists and is up to date (without generating it)"
+        return self._version_is_fresh(
+            self.version_path(version_suffix, extra_options),
+            self._get_options(version_suffix, extra_options), refresh=False)
+
+    def version_generate(self, version_suffix, extra_options=None, force=False):
         "Generate a version"  # FIXME: version_generate for version?
-        path = self.path
-        options = self._get_options(version_suffix, extra_options)
+        return self.versions_generate([version_suffix], extra_options, force)[0]
 
-        version_path = self.version_path(version_suffix, extra_options)
-        if not self.site.storage.isfile(version_path):
-            version_path = self._generate_version(version_path, version_suffix, options)
-        elif get_modified_time(self.site.storage, path) > get_modified_time(self.site.storage, version_path):
-            version_path = self._generate_version(version_path, version_suffix, options)
-        return FileObject(version_path, site=self.site)
+    def versions_generate(self, version_suffixes, extra_options=None, force=False):
+        """
+        Generate a list of versions.
+        The original is opened (and decoded) only once for all versions
+        which do not exist or are older than the original (or all
+        versions, if force is True). With VERSION_MANIFEST, the manifest
+        is updated once for all versions.
+        """
+        path = self.path
+        version_paths = []
+        outdated = []
+        original_time = None
+        # versions found with the storage or generated (added to the manifest)
+        entries = {}
+        for version_suffix in version_suffixes:
+            version_path = self.version_path(version_suffix, extra_options)
+            if force:
+                outdated.append(len(version_paths))
+                version_paths.append(version_path)
+                continue
+            if VERSION_MANIFEST:
+                manifest_path = manifest.get_manifest_path(version_path)
+                options = self._get_options(version_suffix, extra_options)
+                version_manifest = manifest.get_manifest(self.site, manifest_path)
+                if manifest.is_fresh(version_manifest, self, version_path, options):
+                    metrics.increment('version_cache', suffix=version_suffix, result='hit')
+                    version_paths.append(version_path)
+                    continue
+                if os.path.basename(version_path) in version_manifest:
+                    # generated from an older original or with other options
+                    metrics.increment('version_cache', suffix=version_suffix, result='miss')
+                    outdated.append(len(version_paths))
+                    version_paths.append(version_path)
+                    continue
+            version = self.site.versions_storage.stat(version_path)
+            if version.exists and not version.is_dir:
+                if original_time is None:
+                    original_time = get_modified_time(self.storage, path)
+                if original_time <= (version.mtime or get_modified_time(self.site.versions_storage, version_path)):
+                    metrics.increment('version_cache', suffix=version_suffix, result='hit')
+                    version_paths.append(version_path)
+                    if VERSION_MANIFEST:
+                        entries[os.path.basename(version_path)] = manifest.get_entry(self, options, version.size)
+                    continue
+            metrics.increment('version_cache', suffix=version_suffix, result='miss')
+            outdated.append(len(version_paths))
+            version_paths.append(version_path)
+
+        if outdated:
+            options_list = [self._get_options(version_suffixes[i], extra_options) for i in outdated]
+            # (file, image) of the original, with VERSION_CASCADE/VERSION_WORKERS only opened if needed
+            original = None
+            if not VERSION_CASCADE and not VERSION_WORKERS:
+                original = self._open_original_for_versions(options_list)
+            # only one process generates a version, the others are waiting
+            # (locks are acquired in the order of the paths)
+            with contextlib.ExitStack() as locks:
+                # (index, options) of the versions generated from the original
+                pending = []
+                for i, options in sorted(zip(outdated, options_list), key=lambda item: version_paths[item[0]]):
+                    if original is not None and original[1] is None:
+                        version_paths[i] = ""
+                        continue
+                    acquired = locks.enter_context(self.site.versions_storage.lock(version_paths[i], VERSION_LOCK_TIMEOUT))
+                    if not acquired:
+                        if not self.site.versions_storage.isfile(version_paths[i]):
+                            version_paths[i] = ""
+                    elif force or not self._version_is_fresh(version_paths[i], options):
+                        version_path = None
+                        if VERSION_CASCADE:
+                            version_path = self._generate_from_version(version_paths[i], version_suffixes[i], options, entries)
+                        if version_path is None:
+                            pending.append((i, options))
+                        else:
+                            version_paths[i] = version_path
+                if pending and VERSION_WORKERS:
+                    # one job per original (decoded once for all versions)
+                    generated = workers.generate_versions(
+                        self, [(version_paths[i], version_suffixes[i], options) for i, options in pending], entries)
+                    if generated is not None:
+                        for (i, options), version_path in zip(pending, generated):
+                            version_paths[i] = version_path
+                        pending = []
+                for i, options in pending:
+                    if original is None:
+                        original = self._open_original_for_versions([options for i, options in pending])
+                    f, im = original
+                    version_paths[i] = self._generate_version(version_paths[i], version_suffixes[i], options, im=im, source=f, entries=entries) if im is not None else ""
+            for i in outdated:
+                forget_fileobject(version_paths[i], site=self.site)
+            if original is not None and original[0]:
+                original[0].close()
+        if VERSION_MANIFEST and entries:
+            # all versions of an original are within the same directory
+            manifest.update_manifest(self.site, manifest.get_manifest_path(self.version_path(version_suffixes[0], extra_options)), entries)
+        return [get_fileobject(version_path, site=self.site) for version_path in version_paths]
+
+    def _version_is_fresh(self, version_path, options, refresh=True):
+        """
+        True, if the version exists and is not older than the original
+        (with VERSION_MANIFEST: if the manifest has the version for the
+        current original and options, read again from the storage if
+        refresh is True).
+        """
+        if VERSION_MANIFEST:
+            version_manifest = manifest.get_manifest(self.site, manifest.get_manifest_path(version_path), refresh=refresh)
+            return manifest.is_fresh(version_manifest, self, version_path, options)
+        version = self.site.versions_storage.stat(version_path)
+        if not version.exists or version.is_dir:
+            return False
+        version_mtime = version.mtime or get_modified_time(self.site.versions_storage, version_path)
+        return get_modified_time(self.storage, self.path) <= version_mtime
+
+    def _open_original(self, options_list, decode=True):
+        """
+        Open (and decode) the original for generating versions with options_list.
+        Returns (file, image), both are None if the original is not available
+        or exceeds VERSION_MAX_PIXELS.
+        """
+        with stage('open', self.path):
+            try:
+                f = open_source(self)
+            except IOError:
+                return None, None
+            im = Image.open(f)
+        size = im.size
+        if VERSION_MAX_PIXELS and not fit_pixel_budget(im, VERSION_MAX_PIXELS, get_required_size(im.size, options_list)):
+            metrics.increment('version_refused')
+            f.close()
+            return None, None
+        # the bytes of the original are only usable for versions of a full-size image
+        im.filebrowser_full_size = im.size == size
+        if decode:
+            with stage('decode', self.path):
+                im.load()
+        return f, im
+
+    def _open_original_for_versions(self, options_list):
+        "Open the original for generating versions with options_list and update its metadata"
+        # decoded when generating the first version (see _may_copy_original)
+        f, im = self._open_original(options_list, decode=False)
+        if im is not None and (LQIP or VERSION_ANALYZERS):
+            with stage('analyze', self.path):
+                metadata = get_metadata(self)
+                if self._missing_metadata(metadata):
+                    metadata = self._update_metadata(im, metadata)
+            self.metadata = metadata
+        return f, im
+
+    @staticmethod
+    def _may_cascade(options):
+        "True, if a version with options may be generated from (or be the source of) another version"
+        return not (options.get('methods') or options.get('format_options') or 'upscale' in (options.get('opts') or ''))
+
+    def _get_cascade_source(self, version_path, version_suffix, options):
+        """
+        Open the smallest existing (and fresh) version which is at least
+        VERSION_CASCADE_MIN_RATIO times larger than the version with options.
+        Returns (file, image), both are None if there is no such version.
+        """
+        width = float(options.get('width') or 0)
+        height = float(options.get('height') or 0)
+        if not self._may_cascade(options) or not (width or height):
+            return None, None
+        crop = 'crop' in (options.get('opts') or '')
+        quality = VERSIONS.get(version_suffix, {}).get('quality', VERSION_QUALITY)
+        ext = os.path.splitext(version_path)[1]
+        candidates = []
+        for suffix in VERSIONS:
+            source_options = self._get_options(suffix)
+            source_width = float(source_options.get('width') or 0) or float('inf')
+            source_height = float(source_options.get('height') or 0) or float('inf')
+            if suffix == version_suffix or not self._may_cascade(source_options) or 'crop' in (source_options.get('opts') or ''):
+                continue
+            if source_options.get('quality', VERSION_QUALITY) < quality:
+                continue
+            if source_width < width * VERSION_CASCADE_MIN_RATIO or source_height < height * VERSION_CASCADE_MIN_RATIO:
+                continue
+            candidates.append((source_width * source_height, suffix, source_options))
+        for area, suffix, source_options in sorted(candidates, key=lambda candidate: candidate[:2]):
+            source_path = self.version_path(suffix)
+            if os.path.splitext(source_path)[1] != ext or not self._version_is_fresh(source_path, source_options, refresh=False):
+                continue
+            with stage('open', source_path):
+                try:
+                    f = self.site.versions_storage.open(source_path)
+                    im = Image.open(f)
+                except (IOError, ValueError):
+                    continue
+            x, y = [float(v) for v in im.size]
+            ratios = [r for r in (width / x, height / y) if r]
+            r = max(ratios) if crop else min(ratios)
+            if r * VERSION_CASCADE_MIN_RATIO <= 1.0:
+                return f, im
+            f.close()
+        return None, None
+
+    def _generate_from_version(self, version_path, version_suffix, options, entries=None):
+        """
+        Generate a version from a larger version (see VERSION_CASCADE).
+        Returns None if there is no suitable larger version.
+        """
+        f, im = self._get_cascade_source(version_path, version_suffix, options)
+        if im is None:
+            return None
+        try:
+            metrics.increment('version_cascaded', suffix=version_suffix)
+            return self._generate_version(version_path, version_suffix, options, im=im, entries=entries)
+        finally:
+            f.close()
 
-    def _generate_version(self, version_path, version_suffix, options):
+    def _may_copy_original(self, im, options, ext):
+        """
+        True, if the version might be the unchanged original (e.g. an icon
+        smaller than the version): the original is not scaled down, has the
+        format of the version and only built-in processors run (a custom
+        processor may change the image in place). Originals with metadata
+        (e.g. EXIF with GPS coordinates) are encoded, which removes the
+        metadata. Such originals are only decoded if a processor changes them.
+        """
+        if 'methods' in options or options.get('format_options') or not processors_are_builtin():
+            return False
+        if any(key in im.info for key in ORIGINAL_METADATA_KEYS):
+            return False
+        if not getattr(im, 'filebrowser_full_size', False) or im.format != get_extension_format(ext):
+            return False
+        return tuple(get_required_size(im.size, [options])) == tuple(im.size)
+
+    def _generate_version(self, version_path, version_suffix, options, im=None, source=None, entries=None):
         """
         Generate Version for an Image.
         value has to be a path relative to the storage location.
+
+        im is the (already opened) original image, shared by several
+        versions: processors which are not pure (see
+        filebrowser.utils.processors_are_pure) and methods get a copy.
+        source is the opened file of the original, if a processor does not
+        change the image, the version is a copy of source.
+        entries collects the manifest entry of the version (written to the
+        manifest by the caller), without entries the manifest is updated
+        (with VERSION_MANIFEST).
         """
 
-        tmpfile = File(tempfile.NamedTemporaryFile())
+        start = time.perf_counter()
 
-        try:
-            f = self.site.storage.open(self.path)
-        except IOError:
-            return ""
-        im = Image.open(f)
+        if im is None:
+            source, im = self._open_original([options], decode=False)
+            if im is None:
+                return ""
+            try:
+                return self._generate_version(version_path, version_suffix, options, im=im, source=source, entries=entries)
+            finally:
+                source.close()
         version_dir, version_basename = os.path.split(version_path)
         root, ext = os.path.splitext(version_basename)
-        version = process_image(im, options)
-        if not version:
-            version = im
-        if 'methods' in options:
-            for m in options['methods']:
-                if callable(m):
-                    version = m(version)
-
-        # IF need Convert RGB
-        if ext in [".jpg", ".jpeg"] and version.mode not in ("L", "RGB"):
-            version = version.convert("RGB")
+        may_copy = source is not None and self._may_copy_original(im, options, ext)
+        if not may_copy:
+            with stage('decode', self.path):
+                im.load()
+        with stage('process', version_path):
+            source_im = im
+            if options.get('methods') or not processors_are_pure():
+                # may be modified in place
+                source_im = im.copy()
+            version = process_image(source_im, options)
+            if not version:
+                version = source_im
+            if 'methods' in options:
+                for m in options['methods']:
+                    if callable(m):
+                        version = m(version)
+
+            # IF need Convert RGB
+            if ext in [".jpg", ".jpeg"] and version.mode not in ("L", "RGB"):
+                version = version.convert("RGB")
+
+        if may_copy and version is im:
+            # nothing has been changed, save the original without encoding it again
+            with stage('save', version_path):
+                self.site.versions_storage.replace(version_path, source)
+                if DEFAULT_PERMISSIONS is not None:
+                    os.chmod(self.site.versions_storage.path(version_path), DEFAULT_PERMISSIONS)
+            metrics.increment('version_copied', suffix=version_suffix)
+            self._record_version(version_path, options, source.size, entries)
+            metrics.observe('version_generation_seconds', time.perf_counter() - start, suffix=version_suffix)
+            return version_path
 
         # save version
+        buf = EncodeBuffer()
         quality = VERSIONS.get(version_suffix, {}).get("quality", VERSION_QUALITY)
-        try:
-            version.save(tmpfile, format=Image.EXTENSION[ext.lower()], quality=quality, optimize=(os.path.splitext(version_path)[1] != '.gif'))
-        except IOError:
-            version.save(tmpfile, format=Image.EXTENSION[ext.lower()], quality=quality)
-        # remove old version, if any
-        if version_path != self.site.storage.get_available_name(version_path):
-            self.site.storage.delete(version_path)
-        self.site.storage.save(version_path, tmpfile)
-        # set permissions
-        if DEFAULT_PERMISSIONS is not None:
-            os.chmod(self.site.storage.path(version_path), DEFAULT_PERMISSIONS)
+        save_options = {'quality': quality, 'optimize': ext.lower() != '.gif'}
+        save_options.update(options.get('format_options') or {})
+        image_format = get_extension_format(ext)
+        with stage('encode', version_path):
+            try:
+                version.save(buf, format=image_format, **save_options)
+            except IOError:
+                save_options.pop('optimize')
+                version.save(buf, format=image_format, **save_options)
+        size = buf.tell()
+        metrics.increment('version_encoded_bytes', size, suffix=version_suffix)
+        with stage('save', version_path):
+            # replaces an old version (without removing it first)
+            self.site.versions_storage.replace(version_path, File(buf))
+            # set permissions
+            if DEFAULT_PERMISSIONS is not None:
+                os.chmod(self.site.versions_storage.path(version_path), DEFAULT_PERMISSIONS)
+        buf.close()
+        self._record_version(version_path, options, size, entries)
+        metrics.observe('version_generation_seconds', time.perf_counter() - start, suffix=version_suffix)
         return version_path
 
+    def _record_version(self, version_path, options, size, entries=None):
+        "Adds a generated version to entries or the manifest (see VERSION_MANIFEST)"
+        entry = {os.path.basename(version_path): manifest.get_entry(self, options, size)}
+        if entries is not None:
+            entries.update(entry)
+        elif VERSION_MANIFEST:
+            manifest.update_manifest(self.site, manifest.get_manifest_path(version_path), entry)
+
     # DELETE METHODS
     # delete()
     # delete_versions()
@@ -547,22 +1068,38 @@ class FileObject():
     def delete(self):
         "Delete FileObject (deletes a folder recursively)"
         if self.is_folder:
-            self.site.storage.rmtree(self.path)
+            self.storage.rmtree(self.path)
         else:
-            self.site.storage.delete(self.path)
+            self.storage.delete(self.path)
+        forget_fileobject(self.path, site=self.site)
+        delete_metadata(self)
 
     def delete_versions(self):
-        "Delete versions"
-        for version in self.versions():
+        "Delete versions (and the sprites of the directory)"
+        delete_metadata(self)
+        delete_sprites(self.site, self.dirname)
+        versions = self.versions()
+        for version in versions:
             try:
-                self.site.storage.delete(version)
+                self.site.versions_storage.delete(version)
             except:
                 pass
+            forget_fileobject(version, site=self.site)
+        if VERSION_MANIFEST and versions:
+            manifest.update_manifest(self.site, manifest.get_manifest_path(versions[0]), {
+                os.path.basename(version): None for version in versions
+            })
 
     def delete_admin_versions(self):
         "Delete admin versions"
-        for version in self.admin_versions():
+        versions = self.admin_versions()
+        for version in versions:
             try:
-                self.site.storage.delete(version)
+                self.site.versions_storage.delete(version)
             except:
                 pass
+            forget_fileobject(version, site=self.site)
+        if VERSION_MANIFEST and versions:
+            manifest.update_manifest(self.site, manifest.get_manifest_path(versions[0]), {
+                os.path.basename(version): None for version in versions
+            })
@@ -1,4 +1,5 @@
 import os
+import time
 
 from django.contrib import messages
 from django.core.exceptions import ImproperlyConfigured
@@ -6,13 +7,19 @@ from django.http import HttpResponseRedirect
 from django.urls import reverse
 from django.utils.translation import gettext as _
 
+from filebrowser.base import fileobject_registry, get_fileobject
+from filebrowser.settings import ROOT_CHECK_TTL
 from filebrowser.templatetags.fb_tags import query_helper
 
+# Successful checks of site roots: (site, site.directory) -> time of the check
+_checked_roots = {}
+
 
 def get_path(path, site):
     converted_path = os.path.join(site.directory, path)
     if not path.startswith('.') and not os.path.isabs(converted_path):
-        if site.storage.isdir(converted_path):
+        # the FileObject (with the result of stat) is shared with the view
+        if get_fileobject(converted_path, site=site).stat.is_dir:
             return path
 
 
@@ -20,16 +27,28 @@ def get_file(path, filename, site):
     # Files and directories are valid
     converted_path = os.path.join(site.directory, path, filename)
     if not path.startswith('.') and not filename.startswith('.') and not os.path.isabs(converted_path):
-        if site.storage.isfile(converted_path) or site.storage.isdir(converted_path):
+        if get_fileobject(converted_path, site=site).stat.exists:
             return filename
 
 
+def root_exists(site):
+    "Check if the site root exists (a successful check is cached for ROOT_CHECK_TTL seconds)."
+    key = (site, site.directory)
+    checked = _checked_roots.get(key)
+    if checked is not None and time.time() - checked < ROOT_CHECK_TTL:
+        return True
+    if get_path('', site=site) is None:
+        return False
+    _checked_roots[key] = time.time()
+    return True
+
+
 def path_exists(site, function):
     "Check if the given path exists."
 
     def decorator(request, *args, **kwargs):
         # TODO: This check should be moved to a better location than a decorator
-        if get_path('', site=site) is None:
+        if not root_exists(site):
             # The storage location does not exist, raise an error to prevent eternal redirecting.
             raise ImproperlyConfigured(_("Error finding Upload-Folder (site.storage.location + site.directory). Maybe it does not exist?"))
         if get_path(request.GET.get('dir', ''), site=site) is None:
@@ -53,3 +72,12 @@ def file_exists(site, function):
             return HttpResponseRedirect(redirect_url)
         return function(request, *args, **kwargs)
     return decorator
+
+
+def share_fileobjects(function):
+    "Share FileObjects (and their cached properties) within the request."
+
+    def decorator(request, *args, **kwargs):
+        with fileobject_registry():
+            return function(request, *args, **kwargs)
+    return decorator
@@ -1,10 +1,12 @@
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from filebrowser.base import FileListing
-from filebrowser.settings import DIRECTORY, EXCLUDE, EXTENSION_LIST, VERSIONS
+from filebrowser.settings import (DIRECTORY, EXCLUDE, EXTENSION_LIST,
+                                  VERSION_MANIFEST, VERSIONS)
 
 filter_re = []
 for exp in EXCLUDE:
@@ -19,6 +21,13 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('media_path', nargs=1)
+        parser.add_argument(
+            '--stale-only', action='store_true',
+            help='Only (re)generate versions which are missing or older than the original '
+                 '(with VERSION_MANIFEST: missing within the manifest or generated with other options).')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Number of images processed in parallel with --stale-only.')
 
     def handle(self, *args, **options):
         media_path = ""
@@ -32,6 +41,23 @@ class Command(BaseCommand):
         if not os.path.isdir(os.path.join(settings.MEDIA_ROOT, path)):
             raise CommandError('<media_path> must be a directory in MEDIA_ROOT (If you don\'t add a media_path the default path is DIRECTORY).\n"%s" is no directory.' % path)
 
+        if options['stale_only']:
+            if not VERSION_MANIFEST:
+                self.stderr.write('Without VERSION_MANIFEST, versions with changed options are not detected.\n')
+            filelisting = FileListing(path, filter_func=self.filter_images)
+            images = [f for f in filelisting.files_walk_filtered() if f.filetype == "Image"]
+            errors = 0
+            with ThreadPoolExecutor(max(options['workers'], 1)) as executor:
+                for fileobject, stale, error in executor.map(self.generate_stale, images):
+                    if stale:
+                        self.stdout.write('generating versions %s for: %s\n' % (', '.join(stale), fileobject.path))
+                    if error is not None:
+                        errors += 1
+                        self.stderr.write('Error generating versions for %s: %s\n' % (fileobject.path, error))
+            if errors:
+                raise CommandError('Generating versions failed for %d of %d images.' % (errors, len(images)))
+            return
+
         # get version name
         while 1:
             self.stdout.write('\nSelect a version you want to generate:\n')
@@ -84,6 +110,22 @@ class Command(BaseCommand):
         #         if extension in EXTENSIONS["Image"]:
         #             self.createVersions(os.path.join(rel_dir, filename), selected_version)
 
+    def generate_stale(self, fileobject):
+        """
+        Regenerates the versions of fileobject which do not exist or are not
+        up to date, returns (fileobject, version suffixes, exception or None)
+        """
+        stale = []
+        try:
+            for version_suffix in VERSIONS:
+                if not fileobject.version_exists(version_suffix):
+                    stale.append(version_suffix)
+            if stale:
+                fileobject.versions_generate(stale, force=True)
+        except Exception as e:
+            return fileobject, stale, e
+        return fileobject, stale, None
+
     def filter_images(self, item):
         filtered = item.filename.startswith('.')
         for re_prefix in filter_re:
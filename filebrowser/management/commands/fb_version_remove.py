@@ -2,14 +2,16 @@ import os
 import re
 import sys
 
-from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from filebrowser import manifest
 from filebrowser.settings import EXCLUDE, EXTENSIONS
+from filebrowser.sites import site
+from filebrowser.sources import get_local_path
 
 
 class Command(BaseCommand):
     args = '<media_path>'
-    help = "Remove Image-Versions within FILEBROWSER_DIRECTORY/MEDIA_ROOT."
+    help = "Remove Image-Versions within the storage for versions (site.versions_storage)."
 
     def handle(self, *args, **options):
 
@@ -18,10 +20,12 @@ class Command(BaseCommand):
         if len(args):
             media_path = args[0]
 
-        path = os.path.join(settings.MEDIA_ROOT, media_path)
+        path = get_local_path(site.versions_storage, media_path)
+        if path is None:
+            raise CommandError('The storage for versions has no local files.')
 
         if not os.path.isdir(path):
-            raise CommandError('<media_path> must be a directory in MEDIA_ROOT. "%s" is no directory.' % path)
+            raise CommandError('<media_path> must be a directory within the storage for versions. "%s" is no directory.' % path)
 
         self.stdout.write("\n%s\n" % self.help)
         self.stdout.write("in this case: %s\n" % path)
@@ -85,11 +89,23 @@ class Command(BaseCommand):
         if do_remove == "y":
             for current_file in files:
                 os.remove(current_file)
+            self.remove_from_manifests(path, media_path, files)
             self.stdout.write('%d file(s) removed.\n\n' % len(files))
         else:
             self.stdout.write('No files removed.\n\n')
         return
 
+    def remove_from_manifests(self, path, media_path, files):
+        "Removes the files from the manifests of their directories (see VERSION_MANIFEST)"
+        removed = {}
+        for current_file in files:
+            dirpath, filename = os.path.split(current_file)
+            removed.setdefault(dirpath, {})[filename] = None
+        for dirpath, entries in removed.items():
+            if os.path.isfile(os.path.join(dirpath, manifest.MANIFEST_NAME)):
+                manifest_path = os.path.normpath(os.path.join(media_path, os.path.relpath(dirpath, path), manifest.MANIFEST_NAME))
+                manifest.update_manifest(site, manifest_path, entries)
+
     # get files mathing:
     # path: search recoursive in this path (os.walk)
     # version_name: string is pre/suffix of filename
@@ -116,6 +132,9 @@ class Command(BaseCommand):
                 if filtered:
                     continue
                 (filename_noext, extension) = os.path.splitext(filename)
+                # versions saved with another format (e.g. image_small.jpg.webp)
+                if extension not in EXTENSIONS["Image"]:
+                    (filename_noext, extension) = os.path.splitext(filename_noext)
                 # images only
                 if extension in EXTENSIONS["Image"]:
                     # if image matches with version_name we add it to the file_list
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Mapping
+
+from django.core.files.base import ContentFile
+
+from filebrowser.settings import (VERSION_LOCK_TIMEOUT, VERSION_MANIFEST_TTL,
+                                  VERSION_PROCESSORS, VERSION_QUALITY)
+
+# Manifest of the versions within a directory (see VERSION_MANIFEST), saved
+# next to the versions: version name -> {'source_mtime', 'options', 'size'}.
+# source_mtime is the date of the original the version has been generated
+# from, options is the fingerprint of the options of the version (including
+# the processors and the default quality).
+MANIFEST_NAME = '.manifest.json'
+
+logger = logging.getLogger('filebrowser.manifest')
+
+# (site name, manifest path) -> (expires, manifest)
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest_path(version_path):
+    "Path of the manifest for version_path (within the same directory)"
+    return os.path.join(os.path.dirname(version_path), MANIFEST_NAME)
+
+
+def _stable_repr(value):
+    "repr, but the same for every process (functions are represented by their import path)"
+    if isinstance(value, Mapping):
+        return '{%s}' % ', '.join('%r: %s' % (k, _stable_repr(v)) for k, v in sorted(value.items(), key=lambda item: repr(item[0])))
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ', '.join(_stable_repr(v) for v in value)
+    if callable(value):
+        return '%s.%s' % (getattr(value, '__module__', ''), getattr(value, '__qualname__', type(value).__name__))
+    return repr(value)
+
+
+# Options of a version which do not change the generated image
+COSMETIC_OPTIONS = ('verbose_name',)
+
+
+def get_options_fingerprint(options):
+    "Fingerprint of the effective options of a version (with VERSION_PROCESSORS and VERSION_QUALITY)"
+    options = {k: v for k, v in options.items() if k not in COSMETIC_OPTIONS}
+    key = _stable_repr([options, list(VERSION_PROCESSORS), VERSION_QUALITY])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def _load(site, path):
+    try:
+        with site.versions_storage.open(path) as f:
+            return json.loads(f.read().decode('utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def _prune(site, path, manifest):
+    """
+    Removes the entries of versions which do not exist (e.g. removed without
+    updating the manifest) with one listing of the directory. Returns True
+    if manifest has been changed.
+    """
+    try:
+        files = set(site.versions_storage.listdir(os.path.dirname(path))[1])
+    except FileNotFoundError:
+        files = set()
+    except (OSError, NotImplementedError):
+        return False
+    missing = [name for name in manifest if name not in files]
+    for name in missing:
+        del manifest[name]
+    return bool(missing)
+
+
+def get_manifest(site, path, refresh=False):
+    """
+    Returns the manifest saved with path (without versions which do not
+    exist), kept in memory for VERSION_MANIFEST_TTL seconds (unless
+    refresh is True).
+    """
+    key = (site.name, path)
+    now = time.monotonic()
+    with _manifests_lock:
+        cached = _manifests.get(key)
+    if not refresh and cached is not None and cached[0] > now:
+        return cached[1]
+    manifest = _load(site, path)
+    if manifest:
+        _prune(site, path, manifest)
+    with _manifests_lock:
+        _manifests[key] = (now + VERSION_MANIFEST_TTL, manifest)
+    return manifest
+
+
+def _apply(manifest, entries):
+    "Applies entries to manifest, returns True if manifest has been changed"
+    changed = False
+    for name, entry in entries.items():
+        if entry is None:
+            changed = manifest.pop(name, None) is not None or changed
+        elif manifest.get(name) != entry:
+            manifest[name] = entry
+            changed = True
+    return changed
+
+
+def update_manifest(site, path, entries):
+    """
+    Updates the manifest saved with path with entries (version name ->
+    entry, None removes the version). The manifest is only a cache: if
+    another process keeps it locked longer than VERSION_LOCK_TIMEOUT, a
+    warning is logged and only the manifest in memory is updated (versions
+    missing in the saved manifest are checked with the storage again).
+    """
+    with site.versions_storage.lock(path, VERSION_LOCK_TIMEOUT) as acquired:
+        if acquired:
+            manifest = _load(site, path)
+            pruned = bool(manifest) and _prune(site, path, manifest)
+            if _apply(manifest, entries) or pruned:
+                site.versions_storage.replace(path, ContentFile(json.dumps(manifest, sort_keys=True).encode('utf-8')))
+    if not acquired:
+        logger.warning('Manifest %s is locked, %d entries not saved', path, len(entries))
+        manifest = dict(get_manifest(site, path))
+        _apply(manifest, entries)
+    with _manifests_lock:
+        _manifests[(site.name, path)] = (time.monotonic() + VERSION_MANIFEST_TTL, manifest)
+
+
+def get_entry(fileobject, options, size):
+    "Manifest entry for a version of fileobject"
+    return {
+        'source_mtime': fileobject.date,
+        'options': get_options_fingerprint(options),
+        'size': size,
+    }
+
+
+def is_fresh(manifest, fileobject, version_path, options):
+    "True, if the manifest has version_path for the current original and options"
+    entry = manifest.get(os.path.basename(version_path))
+    if not entry:
+        return False
+    return entry.get('source_mtime') == fileobject.date and entry.get('options') == get_options_fingerprint(options)
@@ -0,0 +1,65 @@
+import hashlib
+
+from django.core.cache import caches
+
+from filebrowser.settings import METADATA_CACHE
+from filebrowser.utils import hamming_distance
+
+# Metadata of originals (e.g. lqip), saved with the cache METADATA_CACHE.
+# Every entry contains the modification time of the original, entries
+# for an older original are ignored.
+
+
+def get_cache():
+    return caches[METADATA_CACHE]
+
+
+def get_metadata_key(fileobject):
+    key = '%s:%s' % (fileobject.site.name, fileobject.path)
+    return 'filebrowser:metadata:%s' % hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_metadata(fileobject):
+    "Returns a dict with the metadata of fileobject (empty, if there's none)"
+    metadata = get_cache().get(get_metadata_key(fileobject))
+    if not metadata or metadata.get('date') != fileobject.date:
+        return {}
+    return metadata
+
+
+def get_many_metadata(fileobjects):
+    "Returns a dict path -> metadata (with one call to the cache)"
+    keys = {get_metadata_key(f): f for f in fileobjects}
+    result = {}
+    for key, metadata in get_cache().get_many(list(keys)).items():
+        fileobject = keys[key]
+        if metadata.get('date') == fileobject.date:
+            result[fileobject.path] = metadata
+    return result
+
+
+def get_similar(fileobject, fileobjects, max_distance=10):
+    """
+    Returns the paths of fileobjects with a perceptual hash (see
+    filebrowser.utils.phash) similar to the hash of fileobject. Only images
+    with a hash within the metadata cache are taken into account.
+    """
+    if not fileobject.phash:
+        return set()
+    images = [f for f in fileobjects if f.filetype == "Image"]
+    return set(
+        path for path, metadata in get_many_metadata(images).items()
+        if metadata.get('phash') and hamming_distance(metadata['phash'], fileobject.phash) <= max_distance
+    )
+
+
+def set_metadata(fileobject, **values):
+    "Adds values to the metadata of fileobject"
+    metadata = dict(get_metadata(fileobject), **values)
+    metadata['date'] = fileobject.date
+    get_cache().set(get_metadata_key(fileobject), metadata, None)
+    return metadata
+
+
+def delete_metadata(fileobject):
+    get_cache().delete(get_metadata_key(fileobject))
@@ -0,0 +1,166 @@
+import bisect
+import contextlib
+import threading
+import time
+
+from django.http import Http404, HttpResponse
+from django.utils.module_loading import import_string
+
+from filebrowser.settings import METRICS_BACKEND
+
+try:
+    import statsd
+except ImportError:
+    statsd = None
+
+# Metrics sent by the FileBrowser:
+# version_cache (counter, tags: suffix, result=hit|miss)
+# version_generation_seconds (histogram, tags: suffix)
+# version_encoded_bytes (counter, tags: suffix)
+# version_refused (counter)
+# version_copied (counter, tags: suffix)
+# version_cascaded (counter, tags: suffix)
+# version_worker (counter, tags: suffix, result=done|timeout|failed)
+# listing_seconds (histogram)
+# listing_files (histogram)
+# upload_seconds (histogram)
+# upload_bytes (counter)
+
+
+class NullBackend:
+    """
+    Ignores all metrics (default).
+    """
+
+    def increment(self, name, value=1, tags=None):
+        pass
+
+    def observe(self, name, value, tags=None):
+        pass
+
+
+class PrometheusBackend(NullBackend):
+    """
+    Collects counters and histograms in-process, rendered with the
+    Prometheus text format by metrics_view.
+    """
+    prefix = 'filebrowser_'
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    buckets = {
+        'listing_files': (10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, value=1, tags=None):
+        key = (name, tuple(sorted((tags or {}).items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, tags=None):
+        key = (name, tuple(sorted((tags or {}).items())))
+        buckets = self.buckets.get(name, self.default_buckets)
+        with self.lock:
+            counts, total = self.histograms.get(key, ([0] * (len(buckets) + 1), 0))
+            counts[bisect.bisect_left(buckets, value)] += 1
+            self.histograms[key] = (counts, total + value)
+
+    def _labels(self, tags, **extra):
+        labels = list(tags) + list(extra.items())
+        if not labels:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+
+    def render(self):
+        "Returns all metrics with the Prometheus text format"
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(counts), total)) for key, (counts, total) in self.histograms.items())
+        typed = set()
+        for (name, tags), value in counters:
+            if name not in typed:
+                lines.append('# TYPE %s%s_total counter' % (self.prefix, name))
+                typed.add(name)
+            lines.append('%s%s_total%s %s' % (self.prefix, name, self._labels(tags), value))
+        for (name, tags), (counts, total) in histograms:
+            if name not in typed:
+                lines.append('# TYPE %s%s histogram' % (self.prefix, name))
+                typed.add(name)
+            cumulative = 0
+            for le, count in zip(list(self.buckets.get(name, self.default_buckets)) + ['+Inf'], counts):
+                cumulative += count
+                lines.append('%s%s_bucket%s %d' % (self.prefix, name, self._labels(tags, le=le), cumulative))
+            lines.append('%s%s_sum%s %s' % (self.prefix, name, self._labels(tags), total))
+            lines.append('%s%s_count%s %d' % (self.prefix, name, self._labels(tags), cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+class StatsdBackend(NullBackend):
+    """
+    Sends metrics with statsd (requires the package statsd). Tags are
+    appended to the name, e.g. filebrowser.version_generation_seconds.small.
+    Histograms are sent as timers (seconds are converted to milliseconds).
+    """
+    prefix = 'filebrowser'
+
+    def __init__(self, client=None):
+        if client is None:
+            if statsd is None:
+                raise ImportError('StatsdBackend requires the package statsd.')
+            client = statsd.StatsClient(prefix=self.prefix)
+        self.client = client
+
+    def _name(self, name, tags):
+        return '.'.join([name] + [str(v) for k, v in sorted((tags or {}).items())])
+
+    def increment(self, name, value=1, tags=None):
+        self.client.incr(self._name(name, tags), value)
+
+    def observe(self, name, value, tags=None):
+        if name.endswith('_seconds'):
+            value = value * 1000
+        self.client.timing(self._name(name, tags), value)
+
+
+# (METRICS_BACKEND, instance)
+_backend = None
+
+
+def get_backend():
+    "Returns the backend defined with METRICS_BACKEND (one instance per process)"
+    global _backend
+    if _backend is None or _backend[0] != METRICS_BACKEND:
+        _backend = (METRICS_BACKEND, import_string(METRICS_BACKEND)() if METRICS_BACKEND else NullBackend())
+    return _backend[1]
+
+
+def increment(name, value=1, **tags):
+    get_backend().increment(name, value, tags)
+
+
+def observe(name, value, **tags):
+    get_backend().observe(name, value, tags)
+
+
+@contextlib.contextmanager
+def timer(name, **tags):
+    "Observes the duration (in seconds) of this block"
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **tags)
+
+
+def metrics_view(request):
+    """
+    Prometheus endpoint, e.g. path('metrics/filebrowser/', metrics_view).
+    """
+    backend = get_backend()
+    if not hasattr(backend, 'render'):
+        raise Http404
+    return HttpResponse(backend.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
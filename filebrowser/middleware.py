@@ -0,0 +1,41 @@
+import logging
+
+from filebrowser.base import fileobject_registry
+from filebrowser.profiling import profile
+
+logger = logging.getLogger('filebrowser.profiling')
+
+
+class FileObjectRegistryMiddleware:
+    """
+    Share FileObjects (and their cached properties) within a request,
+    e.g. with templates using the templatetag version several times for
+    the same image (see filebrowser.base.get_fileobject).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with fileobject_registry():
+            return self.get_response(request)
+
+
+class StorageProfilingMiddleware:
+    """
+    Profile the calls to the storage (see filebrowser.storage.InstrumentedStorage)
+    and the stages of version generation per request. The summary is added
+    to the response (header X-FileBrowser-Profile) and logged.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with profile() as p:
+            response = self.get_response(request)
+        summary = str(p)
+        if summary:
+            response['X-FileBrowser-Profile'] = summary
+            logger.info('%s %s: %s', request.method, request.path, summary)
+        return response
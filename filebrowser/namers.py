@@ -1,33 +1,117 @@
+import os
 import re
+import threading
+from collections import OrderedDict
 
 from django.utils.encoding import force_str
 from django.utils.module_loading import import_string
 
 from .settings import VERSION_NAMER, VERSIONS
+from .utils import get_extension_format, get_format_extension
+
+
+# Max. number of version names kept in memory (see get_version_name)
+VERSION_NAME_CACHE_SIZE = 10000
+
+# (VERSION_NAMER, class)
+_namer_class = None
+
+# (namer class, filename_root, extension, version_suffix, options) -> version name
+_version_names = OrderedDict()
+_version_names_lock = threading.Lock()
+
+
+def get_namer_class():
+    "Returns the class defined with VERSION_NAMER (imported once)"
+    global _namer_class
+    if _namer_class is None or _namer_class[0] != VERSION_NAMER:
+        _namer_class = (VERSION_NAMER, import_string(VERSION_NAMER))
+    return _namer_class[1]
 
 
 def get_namer(**kwargs):
-    namer_cls = import_string(VERSION_NAMER)
-    return namer_cls(**kwargs)
+    return get_namer_class()(**kwargs)
+
+
+def get_version_name(file_object, version_suffix, options):
+    """
+    Name of a version of file_object. Names are kept in memory (the least
+    recently used ones are discarded), unless cache_names of the namer is False.
+    """
+    namer_cls = get_namer_class()
+    kwargs = dict(
+        file_object=file_object,
+        version_suffix=version_suffix,
+        filename_root=file_object.filename_root,
+        extension=file_object.extension,
+        options=options,
+    )
+    if not namer_cls.cache_names:
+        return namer_cls(**kwargs).get_version_name()
+    key = (namer_cls, file_object.filename_root, file_object.extension, version_suffix, repr(sorted(options.items())))
+    with _version_names_lock:
+        name = _version_names.get(key)
+        if name is not None:
+            _version_names.move_to_end(key)
+            return name
+    name = namer_cls(**kwargs).get_version_name()
+    with _version_names_lock:
+        _version_names[key] = name
+        if len(_version_names) > VERSION_NAME_CACHE_SIZE:
+            _version_names.popitem(last=False)
+    return name
 
 
 class VersionNamer:
     "Base namer only for reference"
 
+    # Version names only depend on filename_root, extension, version_suffix
+    # and options (and are kept in memory). Set to False with namers using
+    # anything else (e.g. the path or the content of the file).
+    cache_names = True
+
     def __init__(self, **kwargs):
         self.kwargs = kwargs
         for k, v in kwargs.items():
             setattr(self, k, v)
 
     def get_version_name(self):
-        return self.file_object.filename_root + "_" + self.version_suffix + self.extension
+        return self.file_object.filename_root + "_" + self.version_suffix + self.version_extension
 
     def get_original_name(self):
-        tmp = self.file_object.filename_root.split("_")
+        filename_root, extension = self.original_root_and_extension
+        tmp = filename_root.split("_")
         if tmp[len(tmp) - 1] in VERSIONS:
             return "%s%s" % (
-                self.file_object.filename_root.replace("_%s" % tmp[len(tmp) - 1], ""),
-                self.file_object.extension)
+                filename_root.replace("_%s" % tmp[len(tmp) - 1], ""),
+                extension)
+
+    @property
+    def version_extension(self):
+        """
+        The extension of the version.
+
+        If the version is saved with another format (option "format"),
+        the extension of the original is kept in front of the new
+        extension (e.g. image_small.png.webp) in order to get the
+        original name back.
+        """
+        options = getattr(self, 'options', None) or {}
+        extension = self.file_object.extension
+        if not options.get('format'):
+            return extension
+        format_extension = get_format_extension(options['format'])
+        if not format_extension or get_extension_format(extension) == options['format'].upper():
+            return extension
+        return extension + format_extension
+
+    @property
+    def original_root_and_extension(self):
+        "The filename root and extension of the original (see version_extension)"
+        filename_root, extension = os.path.splitext(self.file_object.filename_root)
+        if extension and get_extension_format(extension):
+            return filename_root, extension
+        return self.file_object.filename_root, self.file_object.extension
 
 
 class OptionsNamer(VersionNamer):
@@ -36,7 +120,7 @@ class OptionsNamer(VersionNamer):
         name = "{root}_{options}{extension}".format(
             root=force_str(self.file_object.filename_root),
             options=self.options_as_string,
-            extension=self.file_object.extension,
+            extension=self.version_extension,
         )
         return name
 
@@ -45,11 +129,11 @@ class OptionsNamer(VersionNamer):
         Restores the original file name wipping out the last
         `_version_suffix--plus-any-configs` block entirely.
         """
-        root = self.file_object.filename_root
+        root, extension = self.original_root_and_extension
         tmp = root.split("_")
         options_part = tmp[len(tmp) - 1]
         name = re.sub('_%s$' % options_part, '', root)
-        return "%s%s" % (name, self.file_object.extension)
+        return "%s%s" % (name, extension)
 
     @property
     def options_as_string(self):
@@ -78,8 +162,8 @@ class OptionsNamer(VersionNamer):
             opts.append('%dx%d' % (width, height))
 
         for k, v in sorted(self.options.items()):
-            if not v or k in ('size', 'width', 'height',
-                              'quality', 'subsampling', 'verbose_name'):
+            if not v or k in ('size', 'width', 'height', 'quality',
+                              'subsampling', 'verbose_name', 'format_options'):
                 continue
             if v is True:
                 opts.append(k)
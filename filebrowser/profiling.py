@@ -0,0 +1,107 @@
+import contextlib
+import contextvars
+import time
+
+from filebrowser import signals
+
+# Profile of the current request (None if nothing is profiled)
+_profile = contextvars.ContextVar('filebrowser_profile', default=None)
+
+
+class Profile:
+    """
+    Collects the calls to the storage (by method and caller) and the
+    stages of version generation (open, decode, process, encode, save).
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.stages = {}
+
+    def add_call(self, method, caller, duration):
+        count, total = self.calls.get((method, caller), (0, 0.0))
+        self.calls[(method, caller)] = (count + 1, total + duration)
+
+    def add_stage(self, stage, duration):
+        count, total = self.stages.get(stage, (0, 0.0))
+        self.stages[stage] = (count + 1, total + duration)
+
+    def methods(self):
+        "Calls and time per storage method"
+        methods = {}
+        for (method, caller), (count, total) in self.calls.items():
+            method_count, method_total = methods.get(method, (0, 0.0))
+            methods[method] = (method_count + count, method_total + total)
+        return methods
+
+    def summary(self):
+        "Returns a (JSON serializable) dict with calls, methods and stages"
+        return {
+            'calls': [
+                {'method': method, 'caller': caller, 'count': count, 'time': total}
+                for (method, caller), (count, total) in sorted(self.calls.items())
+            ],
+            'methods': {method: {'count': count, 'time': total} for method, (count, total) in sorted(self.methods().items())},
+            'stages': {stage: {'count': count, 'time': total} for stage, (count, total) in sorted(self.stages.items())},
+        }
+
+    def __str__(self):
+        "e.g. isdir=12;3.1ms, listdir=1;0.4ms, stage:decode=2;30.2ms"
+        items = ['%s=%d;%.1fms' % (method, count, total * 1000) for method, (count, total) in sorted(self.methods().items())]
+        items += ['stage:%s=%d;%.1fms' % (stage, count, total * 1000) for stage, (count, total) in sorted(self.stages.items())]
+        return ', '.join(items)
+
+
+@contextlib.contextmanager
+def profile():
+    """
+    Collect storage calls and version stages (of the current thread/task)
+    within this block::
+
+        with profile() as p:
+            listing.files_listing_filtered()
+        print(p.summary())
+    """
+    p = Profile()
+    token = _profile.set(p)
+    try:
+        yield p
+    finally:
+        _profile.reset(token)
+
+
+def get_profile():
+    "Returns the active Profile (or None)"
+    return _profile.get()
+
+
+def record_call(storage, method, caller, duration):
+    "Records a call to the storage with the active Profile and sends a signal"
+    p = _profile.get()
+    if p is not None:
+        p.add_call(method, caller, duration)
+    if signals.filebrowser_storage_call.has_listeners():
+        signals.filebrowser_storage_call.send(sender=storage.__class__, storage=storage, method=method, caller=caller, duration=duration)
+
+
+@contextlib.contextmanager
+def stage(name, path=None):
+    """
+    Times a stage of version generation (open, decode, process, encode, save).
+    Does (almost) nothing if neither a Profile is active nor a receiver is
+    connected to filebrowser_version_stage.
+    """
+    p = _profile.get()
+    send = signals.filebrowser_version_stage.has_listeners()
+    if p is None and not send:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        if p is not None:
+            p.add_stage(name, duration)
+        if send:
+            signals.filebrowser_version_stage.send(sender=None, stage=name, path=path, duration=duration)
@@ -45,11 +45,49 @@ VERSION_QUALITY = getattr(settings, 'FILEBROWSER_VERSION_QUALITY', 90)
 ADMIN_VERSIONS = getattr(settings, 'FILEBROWSER_ADMIN_VERSIONS', ['thumbnail', 'small', 'medium', 'big', 'large'])
 # Which Version should be used as Admin-thumbnail.
 ADMIN_THUMBNAIL = getattr(settings, 'FILEBROWSER_ADMIN_THUMBNAIL', 'admin_thumbnail')
+# Pack the admin thumbnails of a page into one image (sprite sheet).
+ADMIN_THUMBNAIL_SPRITES = getattr(settings, 'FILEBROWSER_ADMIN_THUMBNAIL_SPRITES', False)
 
 VERSION_PROCESSORS = getattr(settings, 'FILEBROWSER_VERSION_PROCESSORS', [
+    'filebrowser.utils.auto_orient',
     'filebrowser.utils.scale_and_crop',
 ])
 VERSION_NAMER = getattr(settings, 'FILEBROWSER_VERSION_NAMER', 'filebrowser.namers.VersionNamer')
+# Max. size (in bytes) of an encoded image kept in memory (before writing to a temporary file)
+ENCODE_BUFFER_MAX_SIZE = getattr(settings, 'FILEBROWSER_ENCODE_BUFFER_MAX_SIZE', 8 * 1024 * 1024)
+# Local directory for caching originals of storages without local files (None to disable the cache)
+SOURCE_CACHE_DIR = getattr(settings, 'FILEBROWSER_SOURCE_CACHE_DIR', None)
+# Max. size (in bytes) of the cache for originals, the least recently used files are removed
+SOURCE_CACHE_MAX_SIZE = getattr(settings, 'FILEBROWSER_SOURCE_CACHE_MAX_SIZE', 1024 * 1024 * 1024)
+# Max. number of pixels of an original for generating versions (None for no limit).
+# Larger JPEGs are decoded with a reduced size, other images are refused.
+VERSION_MAX_PIXELS = getattr(settings, 'FILEBROWSER_VERSION_MAX_PIXELS', None)
+# Seconds to wait for another process generating the same version
+VERSION_LOCK_TIMEOUT = getattr(settings, 'FILEBROWSER_VERSION_LOCK_TIMEOUT', 5)
+# Keep a manifest of the versions per directory (checking versions without calls to the storage)
+VERSION_MANIFEST = getattr(settings, 'FILEBROWSER_VERSION_MANIFEST', False)
+# Seconds to keep a manifest in memory
+VERSION_MANIFEST_TTL = getattr(settings, 'FILEBROWSER_VERSION_MANIFEST_TTL', 60)
+# Generate versions from larger (existing) versions instead of the original
+VERSION_CASCADE = getattr(settings, 'FILEBROWSER_VERSION_CASCADE', False)
+# Min. ratio between the size of the larger version and the size of the generated version
+VERSION_CASCADE_MIN_RATIO = getattr(settings, 'FILEBROWSER_VERSION_CASCADE_MIN_RATIO', 2)
+# Number of worker processes generating versions (per process of the web server), 0 to generate versions in-process
+VERSION_WORKERS = getattr(settings, 'FILEBROWSER_VERSION_WORKERS', 0)
+# Max. seconds to wait for a worker (the version is not available, e.g. the placeholder is shown)
+VERSION_WORKER_TIMEOUT = getattr(settings, 'FILEBROWSER_VERSION_WORKER_TIMEOUT', 30)
+# Max. CPU seconds per version generated by a worker (None for no limit)
+VERSION_WORKER_CPU_LIMIT = getattr(settings, 'FILEBROWSER_VERSION_WORKER_CPU_LIMIT', 60)
+# Max. memory (address space in bytes) of a worker (None for no limit)
+VERSION_WORKER_MEMORY_LIMIT = getattr(settings, 'FILEBROWSER_VERSION_WORKER_MEMORY_LIMIT', None)
+# Analyzers for originals (e.g. filebrowser.utils.phash), results are saved with the metadata
+VERSION_ANALYZERS = getattr(settings, 'FILEBROWSER_VERSION_ANALYZERS', [])
+# Cache for metadata of originals (e.g. the LQIP)
+METADATA_CACHE = getattr(settings, 'FILEBROWSER_METADATA_CACHE', 'default')
+# Generate a tiny preview (low quality image placeholder) when generating versions
+LQIP = getattr(settings, 'FILEBROWSER_LQIP', False)
+# Max. width/height of the LQIP in px
+LQIP_SIZE = getattr(settings, 'FILEBROWSER_LQIP_SIZE', 20)
 
 # PLACEHOLDER
 
@@ -91,12 +129,22 @@ DEFAULT_SORTING_BY = getattr(settings, "FILEBROWSER_DEFAULT_SORTING_BY", "date")
 DEFAULT_SORTING_ORDER = getattr(settings, "FILEBROWSER_DEFAULT_SORTING_ORDER", "desc")
 # regex to clean dir names before creation
 FOLDER_REGEX = getattr(settings, "FILEBROWSER_FOLDER_REGEX", r'^[\w._\ /-]+$')
+# Seconds to cache the check of the site root (site.storage.location + site.directory)
+ROOT_CHECK_TTL = getattr(settings, "FILEBROWSER_ROOT_CHECK_TTL", 60)
+# Max. number of threads (per site) resolving attributes like date/filesize of a listing, 0 to disable
+PREFETCH_WORKERS = getattr(settings, "FILEBROWSER_PREFETCH_WORKERS", 0)
+# Max. seconds to wait for resolving the attributes of a listing
+PREFETCH_TIMEOUT = getattr(settings, "FILEBROWSER_PREFETCH_TIMEOUT", 10)
 # Traverse directories when searching
 SEARCH_TRAVERSE = getattr(settings, "FILEBROWSER_SEARCH_TRAVERSE", False)
 # Default Upload and Version Permissions
 DEFAULT_PERMISSIONS = getattr(settings, "FILEBROWSER_DEFAULT_PERMISSIONS", 0o755)
 # Overwrite existing files on upload
 OVERWRITE_EXISTING = getattr(settings, "FILEBROWSER_OVERWRITE_EXISTING", True)
+# Apply the EXIF orientation to uploaded images (rotates the original)
+AUTO_ORIENT_UPLOADS = getattr(settings, "FILEBROWSER_AUTO_ORIENT_UPLOADS", False)
+# Backend for metrics (e.g. filebrowser.metrics.PrometheusBackend), None to disable metrics
+METRICS_BACKEND = getattr(settings, "FILEBROWSER_METRICS_BACKEND", None)
 
 # UPLOAD
 
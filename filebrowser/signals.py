@@ -36,3 +36,14 @@ filebrowser_post_rename = Signal()
 # result: The response you defined with your custom action
 filebrowser_actions_pre_apply = Signal()
 filebrowser_actions_post_apply = Signal()
+
+# profiling signals (only sent if there are receivers)
+# storage: The (instrumented) storage
+# method: Name of the storage method, e.g. isdir
+# caller: Module and function calling the storage, e.g. filebrowser.base:FileObject.exists
+# duration: Duration of the call in seconds
+filebrowser_storage_call = Signal()
+# stage: open, decode, process, encode or save
+# path: Path of the version
+# duration: Duration of the stage in seconds
+filebrowser_version_stage = Signal()
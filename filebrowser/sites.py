@@ -1,5 +1,7 @@
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from time import gmtime, localtime, strftime, time
 
 from django import forms
@@ -16,21 +18,25 @@ from django.utils.translation import gettext as _
 from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 
-from filebrowser import signals
+from filebrowser import metrics, signals
 # Default actions
-from filebrowser.actions import (flip_horizontal, flip_vertical,
-                                 rotate_90_clockwise,
+from filebrowser.actions import (auto_orient_image, flip_horizontal,
+                                 flip_vertical, rotate_90_clockwise,
                                  rotate_90_counterclockwise, rotate_180)
-from filebrowser.base import FileListing, FileObject
-from filebrowser.decorators import file_exists, path_exists
-from filebrowser.settings import (ADMIN_THUMBNAIL, ADMIN_VERSIONS,
-                                  CONVERT_FILENAME, DEFAULT_PERMISSIONS,
-                                  DEFAULT_SORTING_BY, DEFAULT_SORTING_ORDER,
+from filebrowser.base import (FileListing, FileObject, forget_fileobject,
+                              get_fileobject)
+from filebrowser.decorators import file_exists, path_exists, share_fileobjects
+from filebrowser.metadata import get_similar
+from filebrowser.settings import (ADMIN_THUMBNAIL, ADMIN_THUMBNAIL_SPRITES,
+                                  ADMIN_VERSIONS, AUTO_ORIENT_UPLOADS, CONVERT_FILENAME,
+                                  DEFAULT_PERMISSIONS, DEFAULT_SORTING_BY,
+                                  DEFAULT_SORTING_ORDER,
                                   DIRECTORY, EXCLUDE, EXTENSION_LIST,
                                   EXTENSIONS, LIST_PER_PAGE, MAX_UPLOAD_SIZE,
                                   NORMALIZE_FILENAME, OVERWRITE_EXISTING,
-                                  SEARCH_TRAVERSE, SELECT_FORMATS,
+                                  PREFETCH_WORKERS, SEARCH_TRAVERSE, SELECT_FORMATS,
                                   UPLOAD_TEMPDIR, VERSIONS, VERSIONS_BASEDIR)
+from filebrowser.sprites import get_sprite
 from filebrowser.storage import FileSystemStorageMixin
 from filebrowser.templatetags.fb_tags import query_helper
 from filebrowser.utils import convert_filename
@@ -174,10 +180,14 @@ class FileBrowserSite:
     """
     filelisting_class = FileListing
 
-    def __init__(self, name=None, app_name='filebrowser', storage=default_storage):
+    def __init__(self, name=None, app_name='filebrowser', storage=default_storage, prefetch_workers=None, versions_storage=None):
         self.name = name
         self.app_name = app_name
         self.storage = storage
+        self.versions_storage = versions_storage
+        self.prefetch_workers = PREFETCH_WORKERS if prefetch_workers is None else prefetch_workers
+        self._prefetch_executor = None
+        self._prefetch_lock = threading.Lock()
 
         self._actions = {}
         self._global_actions = self._actions.copy()
@@ -198,19 +208,39 @@ class FileBrowserSite:
 
     directory = property(_directory_get, _directory_set)
 
+    def _versions_storage_get(self):
+        "Storage for versions (falls back to storage)"
+        return self._versions_storage or self.storage
+
+    def _versions_storage_set(self, val):
+        "Set storage for versions (None for using storage)"
+        self._versions_storage = val
+
+    versions_storage = property(_versions_storage_get, _versions_storage_set)
+
+    @property
+    def prefetch_executor(self):
+        "Thread pool for FileListing.prefetch (None if prefetch_workers is 0)"
+        if not self.prefetch_workers:
+            return None
+        with self._prefetch_lock:
+            if self._prefetch_executor is None:
+                self._prefetch_executor = ThreadPoolExecutor(self.prefetch_workers, thread_name_prefix='filebrowser-prefetch')
+        return self._prefetch_executor
+
     def get_urls(self):
         "URLs for a filebrowser.site"
         from django.urls import re_path
 
         # filebrowser urls (views)
         urlpatterns = [
-            re_path(r'^browse/$', path_exists(self, filebrowser_view(self.browse)), name="fb_browse"),
-            re_path(r'^createdir/', path_exists(self, filebrowser_view(self.createdir)), name="fb_createdir"),
-            re_path(r'^upload/', path_exists(self, filebrowser_view(self.upload)), name="fb_upload"),
-            re_path(r'^delete_confirm/$', file_exists(self, path_exists(self, filebrowser_view(self.delete_confirm))), name="fb_delete_confirm"),
-            re_path(r'^delete/$', file_exists(self, path_exists(self, filebrowser_view(self.delete))), name="fb_delete"),
-            re_path(r'^detail/$', file_exists(self, path_exists(self, filebrowser_view(self.detail))), name="fb_detail"),
-            re_path(r'^version/$', file_exists(self, path_exists(self, filebrowser_view(self.version))), name="fb_version"),
+            re_path(r'^browse/$', share_fileobjects(path_exists(self, filebrowser_view(self.browse))), name="fb_browse"),
+            re_path(r'^createdir/', share_fileobjects(path_exists(self, filebrowser_view(self.createdir))), name="fb_createdir"),
+            re_path(r'^upload/', share_fileobjects(path_exists(self, filebrowser_view(self.upload))), name="fb_upload"),
+            re_path(r'^delete_confirm/$', share_fileobjects(file_exists(self, path_exists(self, filebrowser_view(self.delete_confirm)))), name="fb_delete_confirm"),
+            re_path(r'^delete/$', share_fileobjects(file_exists(self, path_exists(self, filebrowser_view(self.delete)))), name="fb_delete"),
+            re_path(r'^detail/$', share_fileobjects(file_exists(self, path_exists(self, filebrowser_view(self.detail)))), name="fb_detail"),
+            re_path(r'^version/$', share_fileobjects(file_exists(self, path_exists(self, filebrowser_view(self.version)))), name="fb_version"),
             re_path(r'^upload_file/$', staff_member_required(csrf_exempt(self._upload_file)), name="fb_do_upload"),
         ]
         return urlpatterns
@@ -314,6 +344,14 @@ class FileBrowserSite:
         filter_date = query.get('filter_date')
         filter_format = query.get('type')
 
+        # similar images (served from the metadata cache, see VERSION_ANALYZERS)
+        similar = None
+        if query.get('similar'):
+            similar = get_similar(get_fileobject(os.path.join(self.directory, query.get('similar')), site=self), listing)
+
+        # every fileobject is checked for being a folder (and for its date)
+        filelisting.prefetch(listing, ('filetype', 'date') if filter_date else 'filetype')
+
         for fileobject in listing:
             # date/type filter, format filter
             append = False
@@ -324,6 +362,8 @@ class FileBrowserSite:
             # search
             if do_search and not re_q.search(fileobject.filename.lower()):
                 append = False
+            if similar is not None and fileobject.path not in similar:
+                append = False
             # always show folders with popups
             # otherwise, one is not able to select/filter files within subfolders
             if fileobject.filetype == "Folder":
@@ -342,10 +382,17 @@ class FileBrowserSite:
         except (EmptyPage, InvalidPage):
             page = p.page(p.num_pages)
 
+        # resolve the attributes shown for the current page concurrently
+        filelisting.prefetch(page.object_list)
+
+        # one image with all admin thumbnails of the current page
+        sprite = get_sprite(page.object_list, self, query.get('dir', ''), page.number) if ADMIN_THUMBNAIL_SPRITES else None
+
         request.current_app = self.name
         return render(request, 'filebrowser/index.html', {
             'p': p,
             'page': page,
+            'sprite': sprite,
             'filelisting': filelisting,
             'query': query,
             'title': _('FileBrowser'),
@@ -410,7 +457,7 @@ class FileBrowserSite:
         "Delete existing File/Directory."
         query = request.GET
         path = os.path.join(self.directory, query.get('dir', ''))
-        fileobject = FileObject(os.path.join(path, query.get('filename', '')), site=self)
+        fileobject = get_fileobject(os.path.join(path, query.get('filename', '')), site=self)
         if fileobject.filetype == "Folder":
             filelisting = self.filelisting_class(
                 os.path.join(path, fileobject.filename),
@@ -444,7 +491,7 @@ class FileBrowserSite:
         "Delete existing File/Directory."
         query = request.GET
         path = os.path.join(self.directory, query.get('dir', ''))
-        fileobject = FileObject(os.path.join(path, query.get('filename', '')), site=self)
+        fileobject = get_fileobject(os.path.join(path, query.get('filename', '')), site=self)
 
         if request.GET:
             try:
@@ -467,7 +514,7 @@ class FileBrowserSite:
         from filebrowser.forms import ChangeForm
         query = request.GET
         path = '%s' % os.path.join(self.directory, query.get('dir', ''))
-        fileobject = FileObject(os.path.join(path, query.get('filename', '')), site=self)
+        fileobject = get_fileobject(os.path.join(path, query.get('filename', '')), site=self)
 
         if request.method == 'POST':
             form = ChangeForm(request.POST, path=path, fileobject=fileobject, filebrowser_site=self)
@@ -488,6 +535,7 @@ class FileBrowserSite:
                         signals.filebrowser_pre_rename.send(sender=request, path=fileobject.path, name=fileobject.filename, new_name=new_name, site=self)
                         fileobject.delete_versions()
                         self.storage.move(fileobject.path, os.path.join(fileobject.head, new_name))
+                        forget_fileobject(fileobject.path, site=self)
                         signals.filebrowser_post_rename.send(sender=request, path=fileobject.path, name=fileobject.filename, new_name=new_name, site=self)
                         messages.add_message(request, messages.SUCCESS, _('Renaming was successful.'))
                     if isinstance(action_response, HttpResponse):
@@ -521,7 +569,7 @@ class FileBrowserSite:
         """
         query = request.GET
         path = os.path.join(self.directory, query.get('dir', ''))
-        fileobject = FileObject(os.path.join(path, query.get('filename', '')), site=self)
+        fileobject = get_fileobject(os.path.join(path, query.get('filename', '')), site=self)
 
         request.current_app = self.name
         return render(request, 'filebrowser/version.html', {
@@ -577,7 +625,9 @@ class FileBrowserSite:
                 return HttpResponse(json.dumps(ret_json))
 
             signals.filebrowser_pre_upload.send(sender=request, path=folder, file=filedata, site=self)
-            uploadedfile = handle_file_upload(path, filedata, site=self)
+            with metrics.timer('upload_seconds'):
+                uploadedfile = handle_file_upload(path, filedata, site=self)
+            metrics.increment('upload_bytes', filedata.size)
 
             if file_already_exists and OVERWRITE_EXISTING:
                 self.storage.move(uploadedfile, file_path, allow_overwrite=True)
@@ -586,6 +636,10 @@ class FileBrowserSite:
                 filedata.name = os.path.relpath(uploadedfile, path)
                 f = FileObject(uploadedfile, site=self)
 
+            # apply the EXIF orientation once, so versions never need it
+            if AUTO_ORIENT_UPLOADS and f.filetype == "Image":
+                auto_orient_image(f)
+
             # set permissions
             if DEFAULT_PERMISSIONS is not None:
                 os.chmod(f.path_full, DEFAULT_PERMISSIONS)
@@ -0,0 +1,123 @@
+import glob
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+
+from django.core.files import File
+
+from filebrowser.settings import SOURCE_CACHE_DIR, SOURCE_CACHE_MAX_SIZE
+
+# Reading originals (e.g. for generating versions): files of a local storage
+# are memory-mapped, files of other storages are read through a local disk
+# cache (SOURCE_CACHE_DIR). Cached files are named by the path and the etag
+# (or modification time and size) of the original, the least recently used
+# files are removed if the cache exceeds SOURCE_CACHE_MAX_SIZE bytes.
+
+
+def get_local_path(storage, path):
+    "Path within the local filesystem, None for storages without local files"
+    try:
+        return storage.path(path)
+    except (AttributeError, NotImplementedError):
+        return None
+
+
+def get_validator(fileobject):
+    "Identifies the current content of fileobject (None, if the storage provides neither etag nor mtime)"
+    stat = fileobject.stat
+    if stat.etag:
+        return stat.etag
+    if stat.mtime is not None:
+        return '%s:%s' % (stat.mtime.isoformat(), stat.size)
+    return None
+
+
+def _cache_prefix(fileobject):
+    key = '%s:%s' % (fileobject.site.name, fileobject.path)
+    return os.path.join(SOURCE_CACHE_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def evict(max_size, keep=None):
+    "Removes the least recently used files until the cache is not larger than max_size bytes"
+    entries = []
+    for entry in os.scandir(SOURCE_CACHE_DIR):
+        if entry.is_file() and not entry.name.startswith('.'):
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def get_cached_path(fileobject):
+    """
+    Path of the cached copy of fileobject (downloaded, if it is not cached
+    or outdated). None, if fileobject can not be cached.
+    """
+    if not SOURCE_CACHE_DIR or not fileobject.exists:
+        return None
+    validator = get_validator(fileobject)
+    if validator is None:
+        return None
+    if fileobject.stat.size is not None and fileobject.stat.size > SOURCE_CACHE_MAX_SIZE:
+        return None
+    prefix = _cache_prefix(fileobject)
+    cached_path = '%s.%s' % (prefix, hashlib.sha1(validator.encode('utf-8')).hexdigest()[:16])
+    if os.path.isfile(cached_path):
+        # mark as recently used
+        os.utime(cached_path)
+        return cached_path
+    os.makedirs(SOURCE_CACHE_DIR, exist_ok=True)
+    for outdated in glob.glob(glob.escape(prefix) + '.*'):
+        try:
+            os.remove(outdated)
+        except OSError:
+            pass
+    # download to a hidden temporary file, then rename
+    fd, tmp_path = tempfile.mkstemp(prefix='.', dir=SOURCE_CACHE_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as tmp, fileobject.storage.open(fileobject.path) as f:
+            shutil.copyfileobj(f, tmp)
+        os.replace(tmp_path, cached_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    evict(SOURCE_CACHE_MAX_SIZE, keep=cached_path)
+    return cached_path
+
+
+def open_mapped(path):
+    "Opens a local file (memory-mapped) as File"
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can not be mapped
+            return File(open(path, 'rb'), name=path)
+    source = File(mapped, name=path)
+    source.size = len(mapped)
+    return source
+
+
+def open_source(fileobject):
+    """
+    Opens the file of fileobject for reading (e.g. for decoding an image).
+    Local files are memory-mapped, other files are read through the local
+    disk cache (if SOURCE_CACHE_DIR is set).
+    """
+    path = get_local_path(fileobject.storage, fileobject.path)
+    if path is None:
+        path = get_cached_path(fileobject)
+    if path is None:
+        return fileobject.storage.open(fileobject.path)
+    return open_mapped(path)
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+
+from filebrowser.settings import (ADMIN_THUMBNAIL, STRICT_PIL, VERSION_QUALITY,
+                                  VERSIONS, VERSIONS_BASEDIR)
+
+if STRICT_PIL:
+    from PIL import Image
+else:
+    try:
+        from PIL import Image
+    except ImportError:
+        import Image
+
+# Folder for sprite sheets (relative to the location of site.versions_storage)
+SPRITES_DIR = os.path.join(VERSIONS_BASEDIR, '_sprites')
+
+
+class Sprite:
+    """
+    One image with the admin thumbnails of a page of a listing.
+    offsets is a dict path -> (y, width, height), the thumbnails are
+    stacked vertically.
+    """
+
+    def __init__(self, url, offsets):
+        self.url = url
+        self.offsets = offsets
+
+    def style(self, fileobject):
+        "CSS for displaying the thumbnail of fileobject, empty if it is not part of the sprite"
+        if fileobject.path not in self.offsets:
+            return ''
+        y, width, height = self.offsets[fileobject.path]
+        return "width: %dpx; height: %dpx; background: url('%s') 0 -%dpx no-repeat;" % (width, height, self.url, y)
+
+
+def get_sprite_key(fileobjects):
+    "Key for the images (paths and modification times) and the options of ADMIN_THUMBNAIL"
+    key = [repr(sorted(VERSIONS.get(ADMIN_THUMBNAIL, {}).items()))]
+    key += ['%s:%s' % (f.path, f.date) for f in fileobjects]
+    return hashlib.sha1('\n'.join(key).encode('utf-8')).hexdigest()
+
+
+def get_sprite_dir(directory):
+    "Folder with the sprite sheets of directory (relative to site.directory)"
+    return os.path.join(SPRITES_DIR, directory)
+
+
+def has_alpha(im):
+    return im.mode in ('RGBA', 'LA', 'PA') or 'transparency' in im.info
+
+
+def get_sprite(fileobjects, site, directory='', page=1):
+    """
+    Returns the Sprite for the images within fileobjects, the page of a
+    listing of directory (or None if there are no images or not all admin
+    thumbnails exist). There's one sprite per directory and page, saved with
+    site.versions_storage and replaced if the images of the page (paths and
+    modification times) change. Thumbnails with transparency are not part
+    of the sprite.
+    """
+    fileobjects = [f for f in fileobjects if f.filetype == "Image"]
+    if not fileobjects:
+        return None
+    storage = site.versions_storage
+    key = get_sprite_key(fileobjects)
+    index_path = os.path.join(get_sprite_dir(directory), 'page_%s.json' % page)
+    index = None
+    if storage.isfile(index_path):
+        with storage.open(index_path) as f:
+            index = json.loads(f.read().decode('utf-8'))
+        if index.get('key') == key:
+            return Sprite(storage.url(index['path']), index['offsets'])
+
+    # thumbnails are generated when rendering the listing (not with the
+    # sprite), the sprite is built with the next request
+    if not all(f.version_exists(ADMIN_THUMBNAIL) for f in fileobjects):
+        return None
+    thumbnails = []
+    for fileobject in fileobjects:
+        try:
+            with storage.open(fileobject.version_path(ADMIN_THUMBNAIL)) as f:
+                im = Image.open(f)
+                im.load()
+        except (IOError, ValueError):
+            continue
+        if has_alpha(im):
+            continue
+        thumbnails.append((fileobject.path, im))
+    if not thumbnails:
+        return None
+
+    width = max(im.size[0] for path, im in thumbnails)
+    height = sum(im.size[1] for path, im in thumbnails)
+    sprite = Image.new('RGB', (width, height), (255, 255, 255))
+    offsets = {}
+    y = 0
+    for path, im in thumbnails:
+        sprite.paste(im.convert('RGB'), (0, y))
+        offsets[path] = (y, im.size[0], im.size[1])
+        y += im.size[1]
+    buf = BytesIO()
+    sprite.save(buf, format='JPEG', quality=VERSION_QUALITY, optimize=True)
+    # the key is part of the name (browsers do not show an outdated sprite)
+    sprite_path = os.path.join(get_sprite_dir(directory), 'page_%s_%s.jpg' % (page, key[:16]))
+    storage.replace(sprite_path, ContentFile(buf.getvalue()))
+    storage.replace(index_path, ContentFile(json.dumps({'key': key, 'path': sprite_path, 'offsets': offsets}).encode('utf-8')))
+    if index and index.get('path') != sprite_path:
+        try:
+            storage.delete(index['path'])
+        except Exception:
+            pass
+    return Sprite(storage.url(sprite_path), offsets)
+
+
+def delete_sprites(site, directory):
+    "Deletes the sprites of directory (e.g. with the versions of an image within directory)"
+    storage = site.versions_storage
+    sprite_dir = get_sprite_dir(directory)
+    try:
+        dirs, files = storage.listdir(sprite_dir)
+    except (OSError, NotImplementedError):
+        return
+    for name in files:
+        try:
+            storage.delete(os.path.join(sprite_dir, name))
+        except Exception:
+            pass
@@ -1,9 +1,44 @@
+import contextlib
+import datetime
+import email.utils
+import functools
+import hashlib
 import os
 import shutil
-
+import stat
+import sys
+import tempfile
+import time
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
 from django.core.files.move import file_move_safe
+from django.utils import timezone
 from filebrowser.base import FileObject
-from filebrowser.settings import DEFAULT_PERMISSIONS
+from filebrowser.profiling import record_call
+from filebrowser.settings import DEFAULT_PERMISSIONS, METADATA_CACHE
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Result of StorageMixin.stat. mtime is a datetime (like get_modified_time).
+# size, mtime and etag are None, if they are not available with the same call.
+StatResult = namedtuple('StatResult', ['exists', 'is_dir', 'size', 'mtime', 'etag'])
+
+# Seconds between attempts to acquire a lock
+LOCK_POLL_INTERVAL = 0.05
+# Seconds until a lock within the cache expires (e.g. if a worker has been killed)
+LOCK_EXPIRE = 300
+
+
+def get_temporary_name(name):
+    "Hidden name within the directory of name, e.g. for writing a file before renaming it"
+    head, tail = os.path.split(name)
+    return os.path.join(head, '.%s.%s.tmp' % (tail, uuid.uuid4().hex[:8]))
 
 
 class StorageMixin:
@@ -23,6 +58,37 @@ class StorageMixin:
         """
         raise NotImplementedError()
 
+    def stat(self, name):
+        """
+        Returns a StatResult (exists, is_dir, size, mtime, etag) with as few
+        calls to the storage as possible.
+        """
+        if self.isdir(name):
+            return StatResult(True, True, None, None, None)
+        if self.isfile(name):
+            return StatResult(True, False, None, None, None)
+        return StatResult(False, False, None, None, None)
+
+    @contextlib.contextmanager
+    def lock(self, name, timeout=0):
+        """
+        Exclusive lock for name (e.g. while generating a version), shared by
+        all processes using the same cache (see METADATA_CACHE). Yields True
+        if the lock has been acquired within timeout seconds, False otherwise.
+        """
+        cache = caches[METADATA_CACHE]
+        key = 'filebrowser:lock:%s' % hashlib.sha1(('%s:%s' % (getattr(self, 'location', ''), name)).encode('utf-8')).hexdigest()
+        deadline = time.monotonic() + timeout
+        acquired = cache.add(key, 1, LOCK_EXPIRE)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            acquired = cache.add(key, 1, LOCK_EXPIRE)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                cache.delete(key)
+
     def move(self, old_file_name, new_file_name, allow_overwrite=False):
         """
         Moves safely a file from one location to another.
@@ -31,6 +97,15 @@ class StorageMixin:
         """
         raise NotImplementedError()
 
+    def replace(self, name, content):
+        """
+        Writes content (a File) to name. An existing file is replaced, without
+        a moment in which name does not exist. Returns name.
+        """
+        tmp_name = self.save(get_temporary_name(name), content)
+        self.move(tmp_name, name, allow_overwrite=True)
+        return name
+
     def makedirs(self, name):
         """
         Creates all missing directories specified by name. Analogue to os.mkdirs().
@@ -58,9 +133,79 @@ class FileSystemStorageMixin(StorageMixin):
     def isfile(self, name):
         return os.path.isfile(self.path(name))
 
+    def stat(self, name):
+        try:
+            st = os.stat(self.path(name))
+        except (OSError, ValueError):
+            return StatResult(False, False, None, None, None)
+        # same as FileSystemStorage.get_modified_time
+        mtime = datetime.datetime.fromtimestamp(st.st_mtime, tz=datetime.timezone.utc if settings.USE_TZ else None)
+        return StatResult(True, stat.S_ISDIR(st.st_mode), st.st_size, mtime, None)
+
+    @contextlib.contextmanager
+    def lock(self, name, timeout=0):
+        if fcntl is None:
+            with super().lock(name, timeout) as acquired:
+                yield acquired
+            return
+        # lock files are kept outside of the storage location
+        lock_dir = os.path.join(tempfile.gettempdir(), 'filebrowser-locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        lock_path = os.path.join(lock_dir, hashlib.sha1(self.path(name).encode('utf-8')).hexdigest() + '.lock')
+        deadline = time.monotonic() + timeout
+        acquired = False
+        while True:
+            f = open(lock_path, 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(LOCK_POLL_INTERVAL)
+                continue
+            # the lock file is removed on release, another process may have
+            # removed it after we opened it (then try again with a new file)
+            try:
+                current = os.stat(lock_path)
+            except FileNotFoundError:
+                current = None
+            if current is not None and current.st_ino == os.fstat(f.fileno()).st_ino:
+                acquired = True
+                break
+            f.close()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                # remove the lock file while holding the lock
+                os.remove(lock_path)
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+
     def move(self, old_file_name, new_file_name, allow_overwrite=False):
         file_move_safe(self.path(old_file_name), self.path(new_file_name), allow_overwrite=True)
 
+    def replace(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # write to a temporary file within the same directory, then rename
+        tmp_path = self.path(get_temporary_name(name))
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
+
     def makedirs(self, name):
         os.makedirs(self.path(name))
 
@@ -95,6 +240,22 @@ class S3BotoStorageMixin(StorageMixin):
             return True
         return False
 
+    def stat(self, name):
+        if not name:
+            return StatResult(True, True, None, None, None)
+        # one HEAD request for a file, a listing of the prefix otherwise
+        key_name = self._encode_name(self._normalize_name(self._clean_name(name)))
+        key = self.bucket.get_key(key_name)
+        if key is not None:
+            mtime = email.utils.parsedate_to_datetime(key.last_modified) if key.last_modified else None
+            if mtime is not None and not settings.USE_TZ:
+                mtime = timezone.make_naive(mtime)
+            etag = key.etag.strip('"') if key.etag else None
+            return StatResult(True, False, key.size, mtime, etag)
+        for item in self.bucket.list(key_name):
+            return StatResult(True, True, None, None, None)
+        return StatResult(False, False, None, None, None)
+
     def move(self, old_file_name, new_file_name, allow_overwrite=False):
 
         if self.exists(new_file_name):
@@ -113,6 +274,11 @@ class S3BotoStorageMixin(StorageMixin):
 
         self.delete(old_file_name)
 
+    def replace(self, name, content):
+        # a PUT replaces an existing key
+        self._save(name, content)
+        return name
+
     def makedirs(self, name):
         pass
 
@@ -127,3 +293,34 @@ class S3BotoStorageMixin(StorageMixin):
         # is set in settings.py with AWS_DEFAULT_ACL.
         # More info: http://django-common-configs.readthedocs.org/en/latest/configs/storage.html
         pass
+
+
+class InstrumentedStorage:
+    """
+    Wraps a storage and records every call (count and time by method and
+    caller) with the active profile (see filebrowser.profiling)::
+
+        site.storage = InstrumentedStorage(site.storage)
+    """
+
+    def __init__(self, storage):
+        self.__dict__['_wrapped'] = storage
+
+    def __getattr__(self, name):
+        attr = getattr(self._wrapped, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def instrumented(*args, **kwargs):
+            code = sys._getframe(1).f_code
+            caller = '%s:%s' % (sys._getframe(1).f_globals.get('__name__'), getattr(code, 'co_qualname', code.co_name))
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                record_call(self._wrapped, name, caller, time.perf_counter() - start)
+        return instrumented
+
+    def __setattr__(self, name, value):
+        setattr(self._wrapped, name, value)
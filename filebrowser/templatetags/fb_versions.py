@@ -3,13 +3,30 @@ from django.core.files import File
 from django.template import Library, Node, Variable, VariableDoesNotExist, TemplateSyntaxError
 
 from filebrowser.settings import VERSIONS, PLACEHOLDER, SHOW_PLACEHOLDER, FORCE_PLACEHOLDER
-from filebrowser.base import FileObject
+from filebrowser.base import FileObject, get_fileobject
 from filebrowser.sites import get_default_site
 
 
 register = Library()
 
 
+def get_source_fileobject(source, context):
+    "FileObject for the source of a version (FileObject, File or path)"
+    if isinstance(source, FileObject):
+        source = source.path
+    elif isinstance(source, File):
+        source = source.name
+    else:  # string
+        source = source
+    site = context.get('filebrowser_site', get_default_site())
+    if FORCE_PLACEHOLDER:
+        return get_fileobject(PLACEHOLDER, site=site)
+    fileobject = get_fileobject(source, site=site)
+    if SHOW_PLACEHOLDER and not (fileobject.exists and not fileobject.is_folder):
+        return get_fileobject(PLACEHOLDER, site=site)
+    return fileobject
+
+
 class VersionNode(Node):
     def __init__(self, src, suffix, var_name):
         self.src = src
@@ -26,18 +43,12 @@ class VersionNode(Node):
             return ""
         if version_suffix not in VERSIONS:
             return ""  # FIXME: should this throw an error?
-        if isinstance(source, FileObject):
-            source = source.path
-        elif isinstance(source, File):
-            source = source.name
-        else:  # string
-            source = source
-        site = context.get('filebrowser_site', get_default_site())
-        if FORCE_PLACEHOLDER or (SHOW_PLACEHOLDER and not site.storage.isfile(source)):
-            source = PLACEHOLDER
-        fileobject = FileObject(source, site=site)
+        fileobject = get_source_fileobject(source, context)
         try:
             version = fileobject.version_generate(version_suffix)
+            if not version.path and SHOW_PLACEHOLDER:
+                # e.g. the original exceeds VERSION_MAX_PIXELS
+                version = get_source_fileobject(PLACEHOLDER, context).version_generate(version_suffix)
             if self.var_name:
                 context[self.var_name] = version
             else:
@@ -78,6 +89,72 @@ def version(parser, token):
         return VersionNode(parser.compile_filter(bits[1]), parser.compile_filter(bits[2]), bits[4])
 
 
+class VersionSrcsetNode(Node):
+    def __init__(self, src, suffixes, var_name):
+        self.src = src
+        self.suffixes = suffixes
+        self.var_name = var_name
+
+    def render(self, context):
+        try:
+            version_suffixes = self.suffixes.resolve(context)
+            source = self.src.resolve(context)
+        except VariableDoesNotExist:
+            if self.var_name:
+                return None
+            return ""
+        if isinstance(version_suffixes, str):
+            version_suffixes = [suffix.strip() for suffix in version_suffixes.split(",")]
+        version_suffixes = [suffix for suffix in version_suffixes if suffix in VERSIONS]
+        fileobject = get_source_fileobject(source, context)
+        srcset = []
+        try:
+            versions = fileobject.versions_generate(version_suffixes)
+            # the real width of a version (smaller than configured, if the original is smaller)
+            urls, widths = set(), set()
+            for version in versions:
+                if not version.path or not version.width:
+                    continue
+                url = version.url
+                if url in urls or version.width in widths:
+                    continue
+                urls.add(url)
+                widths.add(version.width)
+                srcset.append("%s %sw" % (url, version.width))
+        except Exception:
+            if getattr(settings, 'TEMPLATE_DEBUG', True):
+                raise
+        srcset = ", ".join(srcset)
+        if self.var_name:
+            context[self.var_name] = srcset
+            return ""
+        return srcset
+
+
+def version_srcset(parser, token):
+    """
+    Displaying a srcset with several versions of an existing Image (see filebrowser settings VERSIONS).
+    All versions are generated with one call (the original image is opened only once).
+    {% version_srcset fileobject version_suffixes %}
+
+    Use {% version_srcset fileobject 'small,medium,big' %} in order to
+    get "url_small 140w, url_medium 300w, url_big 460w".
+    version_suffixes can be a string (comma separated) or a variable (string or list).
+
+    Return a context variable 'var_name' with the srcset
+    {% version_srcset fileobject version_suffixes as var_name %}
+    """
+
+    bits = token.split_contents()
+    if len(bits) != 3 and len(bits) != 5:
+        raise TemplateSyntaxError("'version_srcset' tag takes 2 or 4 arguments")
+    if len(bits) == 5 and bits[3] != 'as':
+        raise TemplateSyntaxError("second argument to 'version_srcset' tag must be 'as'")
+    if len(bits) == 3:
+        return VersionSrcsetNode(parser.compile_filter(bits[1]), parser.compile_filter(bits[2]), None)
+    return VersionSrcsetNode(parser.compile_filter(bits[1]), parser.compile_filter(bits[2]), bits[4])
+
+
 class VersionSettingNode(Node):
     def __init__(self, version_suffix):
         if (version_suffix[0] == version_suffix[-1] and version_suffix[0] in ('"', "'")):
@@ -111,5 +188,30 @@ def version_setting(parser, token):
         raise TemplateSyntaxError("%s tag received bad version_suffix %s" % (tag, version_suffix))
     return VersionSettingNode(version_suffix)
 
+
+def lqip(source):
+    """
+    Tiny preview (data URI) of an image, e.g. for a blur-up placeholder:
+    <img src="{{ image|lqip }}" data-src="{% version image 'large' %}">
+    """
+    if not source:
+        return ''
+    if not isinstance(source, FileObject):
+        source = get_fileobject(source.name if isinstance(source, File) else source, site=get_default_site())
+    return source.lqip or ''
+
+
+def sprite_style(sprite, fileobject):
+    """
+    CSS for the admin thumbnail of fileobject within a sprite sheet
+    (empty if there's no sprite or fileobject is not part of it).
+    """
+    if not sprite:
+        return ''
+    return sprite.style(fileobject)
+
 register.tag(version)
+register.tag(version_srcset)
 register.tag(version_setting)
+register.filter(lqip)
+register.filter(sprite_style)
@@ -1,19 +1,63 @@
+import base64
+import io
 import math
 import os
 import re
+import tempfile
 import unicodedata
+from io import BytesIO
 
 from django.utils.module_loading import import_string
-from filebrowser.settings import (CONVERT_FILENAME, NORMALIZE_FILENAME,
-                                  STRICT_PIL, VERSION_PROCESSORS)
+from filebrowser.settings import (CONVERT_FILENAME, ENCODE_BUFFER_MAX_SIZE,
+                                  NORMALIZE_FILENAME, STRICT_PIL,
+                                  VERSION_PROCESSORS)
 
 if STRICT_PIL:
     from PIL import Image
+    from PIL import ImageOps
 else:
     try:
         from PIL import Image
+        from PIL import ImageOps
     except ImportError:
         import Image
+        import ImageOps
+
+try:
+    # Registers AVIF with PIL versions not supporting it natively
+    import pillow_avif  # noqa
+except ImportError:
+    pass
+
+# EXIF tag holding the orientation of the camera
+EXIF_ORIENTATION = 0x0112
+
+# Preferred extensions for output formats (see the VERSIONS option "format")
+FORMAT_EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'GIF': '.gif',
+    'TIFF': '.tif',
+    'WEBP': '.webp',
+    'AVIF': '.avif',
+}
+
+
+class EncodeBuffer(tempfile.SpooledTemporaryFile):
+    """
+    Buffer for encoding images, kept in memory up to ENCODE_BUFFER_MAX_SIZE
+    bytes (then written to a temporary file).
+    """
+
+    def __init__(self, max_size=None):
+        super().__init__(max_size=ENCODE_BUFFER_MAX_SIZE if max_size is None else max_size)
+
+    def fileno(self):
+        # PIL writes to the file descriptor if there is one, which would
+        # write the buffer to disk right away
+        if not self._rolled:
+            raise io.UnsupportedOperation('fileno')
+        return super().fileno()
 
 
 def convert_filename(value):
@@ -53,22 +97,120 @@ def path_strip(path, root):
 _default_processors = None
 
 
+def get_processors():
+    "The processors defined with VERSION_PROCESSORS (imported once)"
+    global _default_processors
+    if _default_processors is None:
+        _default_processors = [import_string(name) for name in VERSION_PROCESSORS]
+    return _default_processors
+
+
+def processors_are_pure(processors=None):
+    """
+    True, if all processors are pure: they never modify the source image in
+    place and return the source itself if they do not change it (declared
+    with the attribute pure, e.g. scale_and_crop).
+    """
+    if processors is None:
+        processors = get_processors()
+    return all(getattr(processor, 'pure', False) for processor in processors)
+
+
+def processors_are_builtin(processors=None):
+    """
+    True, if all processors are built-in (auto_orient, scale_and_crop): if
+    they return the source itself, the image has not been changed.
+    """
+    if processors is None:
+        processors = get_processors()
+    return all(processor in (auto_orient, scale_and_crop) for processor in processors)
+
+
 def process_image(source, processor_options, processors=None):
     """
     Process a source PIL image through a series of image processors, returning
     the (potentially) altered image.
     """
-    global _default_processors
     if processors is None:
-        if _default_processors is None:
-            _default_processors = [import_string(name) for name in VERSION_PROCESSORS]
-        processors = _default_processors
+        processors = get_processors()
     image = source
     for processor in processors:
         image = processor(image, **processor_options)
     return image
 
 
+_analyzers = {}
+
+# Max. width/height of the image passed to the analyzers
+ANALYZE_SIZE = 64
+
+
+def analyze_image(source, analyzers, size=ANALYZE_SIZE):
+    """
+    Run the analyzers (see VERSION_ANALYZERS, callables or dotted paths)
+    with a downscaled source image and return their merged results.
+    """
+    x, y = source.size
+    r = min(float(size) / x, float(size) / y, 1.0)
+    small = source.resize((max(1, int(round(x * r))), max(1, int(round(y * r)))), resample=Image.Resampling.BOX, reducing_gap=2.0)
+    results = {}
+    for analyzer in analyzers:
+        if isinstance(analyzer, str):
+            if analyzer not in _analyzers:
+                _analyzers[analyzer] = import_string(analyzer)
+            analyzer = _analyzers[analyzer]
+        results.update(analyzer(small))
+    return results
+
+
+def phash(im):
+    """
+    Perceptual hash (64 bit, as hex string) based on the DCT of the image.
+    Compare hashes with hamming_distance.
+    """
+    n, k = 32, 8
+    im = im.convert('L').resize((n, n), resample=Image.Resampling.BOX)
+    pixels = list(im.getdata())
+    cos = [[math.cos((2 * i + 1) * u * math.pi / (2 * n)) for i in range(n)] for u in range(k)]
+    # DCT of the rows, then of the columns (only the k lowest frequencies)
+    rows = [[sum(c * p for c, p in zip(cos[u], pixels[y * n:(y + 1) * n])) for u in range(k)] for y in range(n)]
+    dct = [sum(cos[v][y] * rows[y][u] for y in range(n)) for v in range(k) for u in range(k)]
+    median = sorted(dct[1:])[len(dct) // 2]
+    bits = ''.join('1' if value > median else '0' for value in dct)
+    return {'phash': '%016x' % int(bits, 2)}
+
+
+def dominant_color(im):
+    "Most frequent color (of 8 quantized colors) as hex string"
+    quantized = im.convert('RGB').quantize(colors=8)
+    count, index = max(quantized.getcolors())
+    r, g, b = quantized.getpalette()[index * 3:index * 3 + 3]
+    return {'dominant_color': '#%02x%02x%02x' % (r, g, b)}
+
+
+def hamming_distance(hash1, hash2):
+    "Number of different bits of two hashes (hex strings)"
+    return bin(int(hash1, 16) ^ int(hash2, 16)).count('1')
+
+
+def auto_orient(im, **kwargs):
+    """
+    Rotate/flip the image according to its EXIF orientation tag.
+
+    Has to run before any processor which resizes the image, since
+    resizing drops the EXIF data.
+    """
+    try:
+        orientation = im.getexif().get(EXIF_ORIENTATION, 1)
+    except Exception:
+        return im
+    if orientation in (None, 1):
+        return im
+    return ImageOps.exif_transpose(im)
+
+auto_orient.pure = True
+
+
 def scale_and_crop(im, width=None, height=None, opts='', **kwargs):
     """
     Scale and Crop.
@@ -109,6 +251,100 @@ def scale_and_crop(im, width=None, height=None, opts='', **kwargs):
     return im
 
 scale_and_crop.valid_options = ('crop', 'upscale')
+scale_and_crop.pure = True
+
+
+def get_required_size(size, options_list):
+    """
+    Smallest size of a source image (with the aspect ratio of size) which
+    is sufficient for generating versions with options_list (see
+    scale_and_crop). Returns size if any version needs the full size.
+    """
+    x, y = [float(v) for v in size]
+    r = 0.0
+    for options in options_list:
+        width = float(options.get('width') or 0)
+        height = float(options.get('height') or 0)
+        if not width and not height:
+            return size
+        if 'crop' in options.get('opts', ''):
+            ri = max(width / x, height / y)
+        else:
+            ri = min(width / x if width else float('inf'), height / y if height else float('inf'))
+        if ri >= 1.0:
+            return size
+        r = max(r, ri)
+    return (int(math.ceil(x * r)), int(math.ceil(y * r)))
+
+
+def fit_pixel_budget(im, max_pixels, required_size):
+    """
+    Check the size of an opened (not yet decoded) image against max_pixels.
+    Oversized JPEGs are decoded with a reduced size (draft mode), but not
+    smaller than required_size. Returns False if im exceeds max_pixels.
+    """
+    x, y = im.size
+    if x * y <= max_pixels:
+        return True
+    if im.format == 'JPEG':
+        im.draft(im.mode, required_size)
+    x, y = im.size
+    return x * y <= max_pixels
+
+
+def get_format_extension(image_format):
+    """
+    Get the file extension for an output format (e.g. "webp").
+    Returns None if PIL is not able to save this format.
+    """
+    image_format = image_format.upper()
+    extensions = Image.registered_extensions()
+    if image_format not in Image.SAVE:
+        return None
+    if image_format in FORMAT_EXTENSIONS:
+        return FORMAT_EXTENSIONS[image_format]
+    for extension, extension_format in sorted(extensions.items()):
+        if extension_format == image_format:
+            return extension
+    return None
+
+
+def get_extension_format(extension):
+    """
+    Get the PIL format for a file extension (e.g. ".jpg").
+    Returns None if the extension is unknown to PIL.
+    """
+    return Image.registered_extensions().get(extension.lower())
+
+
+def get_lqip(im, size=20):
+    """
+    Tiny JPEG preview (low quality image placeholder) of im as data URI.
+    The EXIF orientation is applied to the preview (not to im).
+    """
+    x, y = im.size
+    r = min(float(size) / x, float(size) / y, 1.0)
+    preview = im.resize((max(1, int(round(x * r))), max(1, int(round(y * r)))), resample=Image.Resampling.BOX, reducing_gap=2.0)
+    try:
+        orientation = im.getexif().get(EXIF_ORIENTATION, 1)
+    except Exception:
+        orientation = 1
+    method = {
+        2: Image.Transpose.FLIP_LEFT_RIGHT,
+        3: Image.Transpose.ROTATE_180,
+        4: Image.Transpose.FLIP_TOP_BOTTOM,
+        5: Image.Transpose.TRANSPOSE,
+        6: Image.Transpose.ROTATE_270,
+        7: Image.Transpose.TRANSVERSE,
+        8: Image.Transpose.ROTATE_90,
+    }.get(orientation)
+    if method is not None:
+        preview = preview.transpose(method)
+    if preview.mode not in ("L", "RGB"):
+        preview = preview.convert("RGB")
+    buf = BytesIO()
+    preview.save(buf, format='JPEG', quality=50)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
 
 
 def get_modified_time(storage, path):
@@ -0,0 +1,26 @@
+# Initializer of the worker processes (see filebrowser.workers). Imported by
+# a new worker before Django is set up, so only the standard library is
+# imported at module level (the settings module of a project may import
+# filebrowser itself).
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def init_worker(memory_limit):
+    "Sets up Django, registers the sites and limits the memory of the worker"
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    # custom sites are usually created with the URLconf
+    from django.urls import get_resolver
+    import filebrowser.sites  # NOQA
+    get_resolver().url_patterns
+    if resource is not None and memory_limit:
+        soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            memory_limit = min(memory_limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, hard))
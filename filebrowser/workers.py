@@ -0,0 +1,231 @@
+import concurrent.futures
+import multiprocessing
+import os
+import pickle
+import signal
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+from filebrowser.settings import (VERSION_WORKER_CPU_LIMIT,
+                                  VERSION_WORKER_MEMORY_LIMIT,
+                                  VERSION_WORKER_TIMEOUT, VERSION_WORKERS)
+
+from . import metrics
+from .metadata import set_metadata
+from .worker_setup import init_worker
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Generating versions with a pool of worker processes (see VERSION_WORKERS),
+# the pool is created once per process. Every worker is an executor with
+# one process, a worker which died (e.g. exceeding VERSION_WORKER_CPU_LIMIT)
+# or has been killed (a stuck job) is replaced without affecting the jobs
+# of the other workers. Workers are started with forkserver (or spawn), a
+# web server process with running threads is never forked.
+
+# Seconds to wait for a running job after VERSION_WORKER_TIMEOUT (then its worker is killed)
+GRACE_PERIOD = 5
+
+# (VERSION_WORKERS, VERSION_WORKER_MEMORY_LIMIT, [Worker])
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_context():
+    "The multiprocessing context for starting workers"
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class Worker:
+    "A worker process (an executor with one process)"
+
+    def __init__(self, memory_limit):
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            1, mp_context=get_context(), initializer=init_worker, initargs=(memory_limit,))
+        # the first job of the process
+        self.pid = self.executor.submit(os.getpid)
+        # number of jobs submitted and not finished (see get_worker)
+        self.jobs = 0
+
+    def kill(self):
+        "Kills the process (e.g. with a stuck job)"
+        try:
+            os.kill(self.pid.result(timeout=GRACE_PERIOD), getattr(signal, 'SIGKILL', signal.SIGTERM))
+        except (concurrent.futures.TimeoutError, BrokenProcessPool, OSError):
+            pass
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait)
+
+
+def _set_cpu_limit(seconds):
+    "Limits the CPU time of the worker to seconds from now on (the worker is killed with SIGXCPU)"
+    if resource is None or not seconds:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    limit = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+
+def _generate_versions(app_name, site_name, path, versions, analysis, cpu_limit):
+    """
+    Runs within a worker process, versions is a list of (version path,
+    version suffix, options). The original is opened (and decoded) once.
+    Returns the paths of the versions, their manifest entries and the
+    metadata of the original for analysis (see FileObject._get_analysis).
+    """
+    from filebrowser.base import FileObject
+    from filebrowser.sites import get_site_dict
+    _set_cpu_limit(cpu_limit * len(versions) if cpu_limit else None)
+    fileobject = FileObject(path, site=get_site_dict(app_name)[site_name])
+    f, im = fileobject._open_original([options for version_path, version_suffix, options in versions], decode=False)
+    if im is None:
+        return [""] * len(versions), {}, {}
+    entries = {}
+    try:
+        values = fileobject._analyze(im, analysis) if analysis is not None else {}
+        paths = [
+            fileobject._generate_version(version_path, version_suffix, options, im=im, source=f, entries=entries)
+            for version_path, version_suffix, options in versions
+        ]
+    finally:
+        f.close()
+    return paths, entries, values
+
+
+def get_pool():
+    "Returns the workers (None if VERSION_WORKERS is 0)"
+    global _pool
+    if not VERSION_WORKERS:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool[:2] != (VERSION_WORKERS, VERSION_WORKER_MEMORY_LIMIT):
+            if _pool is not None:
+                for worker in _pool[2]:
+                    worker.shutdown()
+            _pool = (VERSION_WORKERS, VERSION_WORKER_MEMORY_LIMIT, [Worker(VERSION_WORKER_MEMORY_LIMIT) for i in range(VERSION_WORKERS)])
+        return _pool[2]
+
+
+def get_worker():
+    "Returns the worker with the least jobs (None if VERSION_WORKERS is 0), counted as busy until release_worker"
+    workers = get_pool()
+    if workers is None:
+        return None
+    with _pool_lock:
+        worker = min(workers, key=lambda worker: worker.jobs)
+        worker.jobs += 1
+    return worker
+
+
+def release_worker(worker):
+    with _pool_lock:
+        worker.jobs -= 1
+
+
+def replace_worker(worker):
+    "Replaces a dead (or killed) worker"
+    with _pool_lock:
+        if _pool is not None and worker in _pool[2]:
+            _pool[2][_pool[2].index(worker)] = Worker(_pool[1])
+    worker.shutdown()
+
+
+def shutdown_pool(wait=True):
+    "Shuts down the workers (e.g. at the end of a test)"
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        for worker in pool[2]:
+            worker.shutdown(wait=wait)
+
+
+def _wait_after_timeout(worker, future):
+    """
+    Returns the result of a job which did not finish within
+    VERSION_WORKER_TIMEOUT, None if it failed. The worker must not write
+    the versions after the caller released their locks: a job not yet
+    started is cancelled, a running job is waited for GRACE_PERIOD
+    seconds, then its worker is killed.
+    """
+    if future.cancel():
+        return None
+    try:
+        return future.result(timeout=GRACE_PERIOD)
+    except concurrent.futures.TimeoutError:
+        worker.kill()
+        try:
+            # the process is gone when the executor noticed it
+            future.exception(timeout=GRACE_PERIOD)
+        except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError):
+            pass
+        replace_worker(worker)
+    except BrokenProcessPool:
+        replace_worker(worker)
+    except MemoryError:
+        pass
+    return None
+
+
+def generate_versions(fileobject, versions, entries):
+    """
+    Generates versions of fileobject with a worker process, versions is a
+    list of (version path, version suffix, options). Returns the paths of
+    the versions (empty strings if the worker failed: died, ran out of
+    memory or did not finish in time), None if the versions can not be
+    generated by a worker (no pool, options which can not be pickled).
+    The manifest entries of the versions are added to entries, the
+    missing metadata of the original (LQIP, VERSION_ANALYZERS) is
+    generated by the worker as well.
+    """
+    versions = [(version_path, version_suffix, dict(options)) for version_path, version_suffix, options in versions]
+    try:
+        pickle.dumps(versions)
+    except Exception:
+        return None
+    worker = get_worker()
+    if worker is None:
+        return None
+    suffixes = [version_suffix for version_path, version_suffix, options in versions]
+    failed = [""] * len(versions)
+    try:
+        future = worker.executor.submit(
+            _generate_versions, fileobject.site.app_name, fileobject.site.name, fileobject.path,
+            versions, fileobject._get_missing_analysis(), VERSION_WORKER_CPU_LIMIT)
+        try:
+            result = future.result(timeout=VERSION_WORKER_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            _increment(suffixes, 'timeout')
+            result = _wait_after_timeout(worker, future)
+            if result is None:
+                return failed
+        except BrokenProcessPool:
+            replace_worker(worker)
+            _increment(suffixes, 'failed')
+            return failed
+        except MemoryError:
+            _increment(suffixes, 'failed')
+            return failed
+        else:
+            _increment(suffixes, 'done')
+    finally:
+        release_worker(worker)
+    paths, version_entries, values = result
+    if values:
+        fileobject.metadata = set_metadata(fileobject, **values)
+    entries.update(version_entries)
+    return paths
+
+
+def _increment(suffixes, result):
+    for version_suffix in suffixes:
+        metrics.increment('version_worker', suffix=version_suffix, result=result)
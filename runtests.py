@@ -9,6 +9,9 @@ from django.test.utils import get_runner
 if __name__ == "__main__":
     os.environ['DJANGO_SETTINGS_MODULE'] = 'tests.settings'
     django.setup()
+    if sys.argv[1:2] == ['benchmark']:
+        from tests.benchmarks import main
+        sys.exit(main(sys.argv[2:]))
     TestRunner = get_runner(settings)
     test_runner = TestRunner()
     failures = test_runner.run_tests(["tests"])
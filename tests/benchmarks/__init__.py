@@ -0,0 +1,13 @@
+"""
+Benchmarks for the hot paths of the FileBrowser: listings, the browse view,
+version generation and uploads.
+
+Run the benchmarks with the test project and write the results as JSON
+(in order to compare the results of different commits)::
+
+    ./runtests.py benchmark --sizes 1000,10000 --output results.json
+
+The benchmarks build synthetic trees and images within a temporary
+directory, the media files of the test project are not touched.
+"""
+from .suite import main, run  # noqa
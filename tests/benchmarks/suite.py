@@ -0,0 +1,206 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory
+from django.test.utils import setup_databases, teardown_databases
+from django.urls import resolve, reverse
+
+from filebrowser.base import FileListing, FileObject
+from filebrowser.settings import VERSIONS
+from filebrowser.sites import site
+
+from PIL import Image
+import PIL
+
+# Synthetic images: name -> (size, format)
+IMAGES = {
+    'small.jpg': ((640, 480), 'JPEG'),
+    'photo.jpg': ((1920, 1280), 'JPEG'),
+    'large.jpg': ((4000, 3000), 'JPEG'),
+    'screenshot.png': ((1440, 900), 'PNG'),
+}
+# Shapes of the synthetic trees: all files within one folder (wide)
+# or distributed over nested folders (deep)
+SHAPES = ('wide', 'deep')
+DEEP_LEVELS = 10
+
+
+def build_tree(root, files, shape):
+    """
+    Create a tree with empty files below root.
+    """
+    if shape == 'wide':
+        folders = [root]
+    else:
+        folders = []
+        path = root
+        for level in range(DEEP_LEVELS):
+            path = os.path.join(path, 'level%d' % level)
+            folders.append(path)
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+    for i in range(files):
+        folder = folders[i % len(folders)]
+        extension = ('.pdf', '.txt', '.mp3', '.zip')[i % 4]
+        open(os.path.join(folder, 'file%06d%s' % (i, extension)), 'wb').close()
+
+
+def build_image(path, size, image_format):
+    "Create an image with some noise (so that it does not compress to nothing)"
+    noise = Image.effect_noise(size, 64)
+    gradient = Image.linear_gradient('L').resize(size)
+    im = Image.merge('RGB', (noise, gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    im.save(path, format=image_format)
+
+
+def measure(func, repeat, setup=None):
+    "Run func repeat times and return the timings (in seconds)"
+    timings = []
+    for i in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {
+        'repeat': repeat,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'max': max(timings),
+    }
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_request(factory, method, url, **kwargs):
+    request = getattr(factory, method)(url, **kwargs)
+    request.user = get_user_model()(username='benchmark', is_active=True, is_staff=True, is_superuser=True)
+    request._messages = CookieStorage(request)
+    return request
+
+
+def run(sizes=(1000, 10000), repeat=5, stdout=sys.stdout):
+    """
+    Run all benchmarks and return the results as a dict.
+    """
+    results = {}
+    databases = setup_databases(verbosity=0, interactive=False)
+    location = tempfile.mkdtemp(prefix='filebrowser-benchmark-')
+    original_storage = site.storage
+    site.storage = FileSystemStorage(location=location, base_url=settings.MEDIA_URL)
+    factory = RequestFactory()
+
+    def record(name, result):
+        results[name] = result
+        stdout.write('%-45s median %8.2f ms\n' % (name, result['median'] * 1000))
+
+    try:
+        # listings and browse view
+        browse_view = resolve(reverse('filebrowser:fb_browse')).func
+        for files in sizes:
+            for shape in SHAPES:
+                folder = 'bench-%s-%d' % (shape, files)
+                path = os.path.join(site.directory, folder)
+                build_tree(os.path.join(location, path), files, shape)
+
+                def listing():
+                    FileListing(path, filter_func=lambda f: not f.filename.startswith('.'), sorting_by='date', sorting_order='desc', site=site).files_listing_filtered()
+                record('files_listing_filtered[%s-%d]' % (shape, files), measure(listing, repeat))
+
+                def walk():
+                    FileListing(path, sorting_by='date', sorting_order='desc', site=site).files_walk_total()
+                record('files_walk_total[%s-%d]' % (shape, files), measure(walk, repeat))
+
+                def browse():
+                    request = get_request(factory, 'get', reverse('filebrowser:fb_browse'), data={'dir': folder})
+                    response = browse_view(request)
+                    assert response.status_code == 200, response.status_code
+                record('browse[%s-%d]' % (shape, files), measure(browse, repeat))
+
+        # versions
+        images_path = os.path.join(site.directory, 'bench-images')
+        os.makedirs(os.path.join(location, images_path))
+        for filename, (size, image_format) in sorted(IMAGES.items()):
+            build_image(os.path.join(location, images_path, filename), size, image_format)
+            fileobject = FileObject(os.path.join(images_path, filename), site=site)
+            version_suffixes = sorted(VERSIONS)
+
+            def generate():
+                FileObject(fileobject.path, site=site).versions_generate(version_suffixes)
+
+            record('version_generate_cold[%s]' % filename, measure(generate, repeat, setup=fileobject.delete_versions))
+            generate()
+            record('version_generate_warm[%s]' % filename, measure(generate, repeat))
+            record('delete_versions[%s]' % filename, measure(fileobject.delete_versions, repeat, setup=generate))
+
+        # uploads
+        upload_view = resolve(reverse('filebrowser:fb_do_upload')).func
+        for filename in sorted(IMAGES):
+            with open(os.path.join(location, images_path, filename), 'rb') as f:
+                content = f.read()
+
+            def upload():
+                request = get_request(
+                    factory, 'post', reverse('filebrowser:fb_do_upload') + '?folder=bench-uploads',
+                    data={'qqfile': filename, 'file': SimpleUploadedFile(filename, content)})
+                response = upload_view(request)
+                request.close()
+                assert response.status_code == 200, response.status_code
+            os.makedirs(os.path.join(location, site.directory, 'bench-uploads'), exist_ok=True)
+            record('upload_file[%s]' % filename, measure(upload, repeat))
+    finally:
+        site.storage = original_storage
+        shutil.rmtree(location)
+        teardown_databases(databases, verbosity=0)
+
+    return {
+        'meta': {
+            'revision': get_revision(),
+            'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'sizes': list(sizes),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='runtests.py benchmark')
+    parser.add_argument('--sizes', default='1000,10000', help='number of files per synthetic tree (comma separated, e.g. 1000,10000,100000)')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs per benchmark')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run(sizes=sizes, repeat=args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        sys.stdout.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+    return 0
@@ -2,11 +2,13 @@ import ntpath
 import os
 import posixpath
 import shutil
-from unittest.mock import patch
+import time
+from unittest.mock import Mock, patch
 
-from filebrowser.base import FileListing, FileObject
+from filebrowser.base import (FileListing, FileObject, fileobject_registry,
+                              get_fileobject)
 from filebrowser.settings import VERSIONS
-from filebrowser.sites import site
+from filebrowser.sites import FileBrowserSite, site
 
 from . import FilebrowserTestCase as TestCase
 
@@ -348,6 +350,35 @@ class FileObjectAttributeTests(TestCase):
         self.assertEqual(site.storage.exists(f_version_thumb.path), False)
 
 
+class FileObjectRegistryTests(TestCase):
+
+    def setUp(self):
+        super(FileObjectRegistryTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.path = os.path.join(self.DIRECTORY, 'folder', 'testimage.jpg')
+
+    def test_without_registry(self):
+        self.assertIsNot(get_fileobject(self.path, site=site), get_fileobject(self.path, site=site))
+
+    def test_with_registry(self):
+        with fileobject_registry():
+            fileobject = get_fileobject(self.path, site=site)
+            self.assertIs(get_fileobject(self.path, site=site), fileobject)
+            self.assertIs(FileListing(os.path.join(self.DIRECTORY, 'folder'), site=site).files_listing_total()[1], fileobject)
+            with patch.object(site.storage, 'stat', wraps=site.storage.stat) as mock_stat:
+                get_fileobject(self.path, site=site).exists
+                get_fileobject(self.path, site=site).exists
+                self.assertEqual(mock_stat.call_count, 1)
+        self.assertIsNot(get_fileobject(self.path, site=site), fileobject)
+
+    def test_delete(self):
+        with fileobject_registry():
+            fileobject = get_fileobject(self.path, site=site)
+            self.assertTrue(fileobject.exists)
+            fileobject.delete()
+            self.assertFalse(get_fileobject(self.path, site=site).exists)
+
+
 class FileListingTests(TestCase):
     """
     /_test/uploads/testimage.jpg
@@ -435,6 +466,52 @@ class FileListingTests(TestCase):
         self.assertEqual(self.F_LISTING_FOLDER.results_walk_filtered(), 4)
 
 
+class FileListingPrefetchTests(TestCase):
+
+    def setUp(self):
+        super(FileListingPrefetchTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.site = FileBrowserSite(name='prefetch', storage=site.storage, prefetch_workers=2)
+
+    def tearDown(self):
+        self.site.prefetch_executor.shutdown()
+        super(FileListingPrefetchTests, self).tearDown()
+
+    def test_prefetch(self):
+        filelisting = FileListing(self.F_FOLDER.path, site=self.site)
+        fileobjects = filelisting.files_listing_total()
+        self.assertIs(filelisting.prefetch(fileobjects), fileobjects)
+        image = [f for f in fileobjects if f.filename == 'testimage.jpg'][0]
+        for attr in ('date', 'filesize', 'dimensions'):
+            self.assertIn(attr, image.__dict__)
+        self.assertEqual(image.dimensions, (1000, 750))
+
+    def test_sorting(self):
+        filelisting = FileListing(self.F_FOLDER.path, sorting_by='filesize', site=self.site)
+        with patch.object(filelisting, 'prefetch', wraps=filelisting.prefetch) as mock_prefetch:
+            filelisting.files_listing_total()
+        mock_prefetch.assert_called_once_with(filelisting._fileobjects_total, 'filesize')
+
+    def test_timeout(self):
+        fileobject = FileObject(self.F_IMAGE.path, site=self.site)
+
+        def slow_stat(name):
+            time.sleep(0.5)
+            return site.storage.stat(name)
+
+        with patch.object(self.site, 'storage', Mock(stat=slow_stat)):
+            start = time.monotonic()
+            FileListing(self.F_FOLDER.path, site=self.site).prefetch([fileobject], timeout=0.05)
+            self.assertLess(time.monotonic() - start, 0.4)
+
+    def test_disabled(self):
+        disabled_site = FileBrowserSite(name='noprefetch', storage=site.storage, prefetch_workers=0)
+        self.assertIsNone(disabled_site.prefetch_executor)
+        fileobject = FileObject(self.F_IMAGE.path, site=disabled_site)
+        FileListing(self.F_FOLDER.path, site=disabled_site).prefetch([fileobject])
+        self.assertNotIn('date', fileobject.__dict__)
+
+
 class FileObjecNamerTests(TestCase):
 
     PATCH_VERSIONS = {
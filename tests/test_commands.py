@@ -1,11 +1,18 @@
 import os
 import shutil
 import sys
+import time
 from io import StringIO
+from unittest.mock import patch
 
 from django.conf import settings
 from django.core.management import call_command
-from filebrowser.settings import DIRECTORY
+from django.core.management.base import CommandError
+from filebrowser import manifest
+from filebrowser.management.commands import fb_version_remove
+from filebrowser.settings import DIRECTORY, VERSIONS
+from filebrowser.sites import site
+from PIL import Image
 from . import FilebrowserTestCase as TestCase
 
 
@@ -30,3 +37,96 @@ class VersionGenerateCommandTests(TestCase):
         call_command('fb_version_generate', DIRECTORY)
 
         self.assertTrue(os.path.exists(self.version_file))
+
+
+@patch('filebrowser.base.VERSION_MANIFEST', True)
+@patch('filebrowser.management.commands.fb_version_generate.VERSION_MANIFEST', True)
+class VersionGenerateStaleTests(TestCase):
+
+    def setUp(self):
+        super(VersionGenerateStaleTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        manifest._manifests.clear()
+
+    def call_command(self):
+        out = StringIO()
+        call_command('fb_version_generate', DIRECTORY, stale_only=True, workers=2, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_stale_only(self):
+        self.assertIn('generating versions', self.call_command())
+        for version_suffix in VERSIONS:
+            self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, self.F_IMAGE.version_path(version_suffix))))
+        # nothing changed
+        self.assertEqual(self.call_command(), '')
+
+    def test_changed_options(self):
+        self.call_command()
+        versions = dict(VERSIONS, small=dict(VERSIONS['small'], width=100))
+        with patch('filebrowser.base.VERSIONS', versions):
+            self.assertIn('generating versions small for', self.call_command())
+            with Image.open(os.path.join(settings.MEDIA_ROOT, self.F_IMAGE.version_path('small'))) as im:
+                self.assertEqual(im.size[0], 100)
+
+    def test_changed_processors(self):
+        self.call_command()
+        with patch('filebrowser.manifest.VERSION_PROCESSORS', ['filebrowser.utils.scale_and_crop']):
+            output = self.call_command()
+        self.assertEqual(output.count('generating versions'), 1)
+        self.assertIn(', '.join(VERSIONS), output)
+
+    def test_without_manifest(self):
+        err = StringIO()
+        with patch('filebrowser.base.VERSION_MANIFEST', False), \
+                patch('filebrowser.management.commands.fb_version_generate.VERSION_MANIFEST', False):
+            call_command('fb_version_generate', DIRECTORY, stale_only=True, stdout=StringIO(), stderr=err)
+            self.assertIn('not detected', err.getvalue())
+            for version_suffix in VERSIONS:
+                self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, self.F_IMAGE.version_path(version_suffix))))
+            # nothing changed
+            self.assertEqual(self.call_command(), '')
+            # the original has been modified
+            os.utime(self.F_IMAGE.path_full, (0, time.time() + 10))
+            self.assertIn('generating versions %s for' % ', '.join(VERSIONS), self.call_command())
+
+    def test_errors(self):
+        with open(os.path.join(self.FOLDER_PATH, 'broken.jpg'), 'wb') as f:
+            f.write(b'no image')
+        out, err = StringIO(), StringIO()
+        with self.assertRaisesMessage(CommandError, 'failed for 1 of 2 images'):
+            call_command('fb_version_generate', DIRECTORY, stale_only=True, workers=1, stdout=out, stderr=err)
+        self.assertIn('Error generating versions for _test/uploads/folder/broken.jpg', err.getvalue())
+        # the other images are processed
+        self.assertIn('for: _test/uploads/folder/testimage.jpg', out.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, self.F_IMAGE.version_path('large'))))
+
+    def test_version_fingerprint(self):
+        fingerprint = self.F_IMAGE.version_fingerprint('small')
+        self.call_command()
+        entry = manifest.get_manifest(site, manifest.get_manifest_path(self.F_IMAGE.version_path('small')), refresh=True)['testimage_small.jpg']
+        self.assertEqual(entry['options'], fingerprint)
+        self.assertNotEqual(self.F_IMAGE.version_fingerprint('small', {'width': 100}), fingerprint)
+
+
+@patch('filebrowser.base.VERSION_MANIFEST', True)
+class VersionRemoveCommandTests(TestCase):
+
+    def setUp(self):
+        super(VersionRemoveCommandTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        manifest._manifests.clear()
+
+    def test_fb_version_remove(self):
+        version = self.F_IMAGE.version_generate('small')
+        self.F_IMAGE.version_generate('large')
+        manifest_path = manifest.get_manifest_path(version.path)
+        self.addCleanup(setattr, sys, 'stdin', sys.stdin)
+        sys.stdin = StringIO("s\nsmall\ny\n")
+        # media_path is passed to handle (the command does not define arguments)
+        fb_version_remove.Command(stdout=StringIO()).handle('_test/_versions')
+        self.assertFalse(os.path.exists(version.path_full))
+        # removed from the manifest
+        self.assertEqual(sorted(manifest.get_manifest(site, manifest_path, refresh=True)), ['testimage_large.jpg'])
+        with site.storage.open(manifest_path) as f:
+            self.assertNotIn('testimage_small.jpg', f.read().decode('utf-8'))
+        self.assertTrue(os.path.exists(self.F_IMAGE.version_generate('small').path_full))
@@ -1,6 +1,9 @@
 import shutil
+from unittest.mock import patch
 
-from filebrowser.decorators import get_path, get_file
+from django.urls import reverse
+
+from filebrowser.decorators import get_path, get_file, root_exists
 from filebrowser.sites import site
 from . import FilebrowserTestCase as TestCase
 
@@ -55,3 +58,40 @@ class GetFileTests(TestCase):
         self.assertIsNone(get_file('folder/subfolder', 'testimage.jpg', site))
         shutil.copy(self.STATIC_IMG_PATH, self.SUBFOLDER_PATH)
         self.assertTrue(get_file('folder/subfolder', 'testimage.jpg', site))
+
+
+class RootExistsTests(TestCase):
+
+    def test_cached(self):
+        self.assertTrue(root_exists(site))
+        with patch.object(site.storage, 'stat', wraps=site.storage.stat) as mock_stat:
+            self.assertTrue(root_exists(site))
+            self.assertFalse(mock_stat.called)
+
+    @patch('filebrowser.decorators.ROOT_CHECK_TTL', 0)
+    def test_not_cached(self):
+        with patch.object(site.storage, 'stat', wraps=site.storage.stat) as mock_stat:
+            self.assertTrue(root_exists(site))
+            self.assertTrue(mock_stat.called)
+
+
+class StorageProbesTests(TestCase):
+
+    def setUp(self):
+        super(StorageProbesTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.client.login(username=self.user.username, password='password')
+
+    def test_delete_confirm(self):
+        url = reverse('filebrowser:fb_delete_confirm') + '?dir=folder&filename=testimage.jpg'
+        # the check of the site root is cached
+        self.assertTrue(root_exists(site))
+        with patch.object(site.storage, 'stat', wraps=site.storage.stat) as mock_stat, \
+                patch.object(site.storage, 'isdir', wraps=site.storage.isdir) as mock_isdir, \
+                patch.object(site.storage, 'isfile', wraps=site.storage.isfile) as mock_isfile:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # one stat for the folder, one for the file
+        self.assertEqual(sorted(c[0][0] for c in mock_stat.call_args_list), ['_test/uploads/folder', '_test/uploads/folder/testimage.jpg'])
+        self.assertFalse(mock_isdir.called)
+        self.assertFalse(mock_isfile.called)
@@ -0,0 +1,70 @@
+import shutil
+from unittest.mock import Mock, patch
+
+from django.test import RequestFactory
+
+from filebrowser import metrics
+from filebrowser.base import FileListing
+from filebrowser.sites import site
+
+from . import FilebrowserTestCase as TestCase
+
+
+@patch('filebrowser.metrics.METRICS_BACKEND', 'filebrowser.metrics.PrometheusBackend')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        super(MetricsTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        # a new backend for every test
+        metrics._backend = None
+
+    def tearDown(self):
+        metrics._backend = None
+        super(MetricsTests, self).tearDown()
+
+    def test_versions(self):
+        self.F_IMAGE.version_generate('small')
+        self.F_IMAGE.version_generate('small')
+        backend = metrics.get_backend()
+        self.assertEqual(backend.counters[('version_cache', (('result', 'miss'), ('suffix', 'small')))], 1)
+        self.assertEqual(backend.counters[('version_cache', (('result', 'hit'), ('suffix', 'small')))], 1)
+        self.assertGreater(backend.counters[('version_encoded_bytes', (('suffix', 'small'),))], 0)
+        counts, total = backend.histograms[('version_generation_seconds', (('suffix', 'small'),))]
+        self.assertEqual(sum(counts), 1)
+
+    def test_listing(self):
+        FileListing(self.F_FOLDER.path, site=site).files_listing_total()
+        counts, total = metrics.get_backend().histograms[('listing_files', ())]
+        # testimage.jpg and subfolder
+        self.assertEqual(total, 2)
+
+    def test_render(self):
+        metrics.increment('version_cache', suffix='small', result='hit')
+        metrics.observe('listing_files', 20)
+        text = metrics.get_backend().render()
+        self.assertIn('filebrowser_version_cache_total{result="hit",suffix="small"} 1', text)
+        self.assertIn('filebrowser_listing_files_bucket{le="10"} 0', text)
+        self.assertIn('filebrowser_listing_files_bucket{le="50"} 1', text)
+        self.assertIn('filebrowser_listing_files_count 1', text)
+
+    def test_view(self):
+        metrics.increment('upload_bytes', 10)
+        response = metrics.metrics_view(RequestFactory().get('/metrics/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'filebrowser_upload_bytes_total 10', response.content)
+
+    def test_statsd(self):
+        client = Mock()
+        backend = metrics.StatsdBackend(client=client)
+        backend.increment('version_cache', tags={'suffix': 'small', 'result': 'hit'})
+        backend.observe('version_generation_seconds', 0.5, tags={'suffix': 'small'})
+        client.incr.assert_called_with('version_cache.hit.small', 1)
+        client.timing.assert_called_with('version_generation_seconds.small', 500)
+
+
+class NullMetricsTests(TestCase):
+
+    def test_null_backend(self):
+        self.assertIsInstance(metrics.get_backend(), metrics.NullBackend)
+        self.assertFalse(hasattr(metrics.get_backend(), 'render'))
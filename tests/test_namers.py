@@ -1,7 +1,11 @@
 import shutil
 from unittest.mock import patch
 
-from filebrowser.namers import OptionsNamer
+from django.test import override_settings
+from django.utils.module_loading import import_string
+
+from filebrowser import base, namers
+from filebrowser.namers import OptionsNamer, VersionNamer
 from filebrowser.settings import VERSIONS
 from . import FilebrowserTestCase as TestCase
 
@@ -89,3 +93,61 @@ class OptionsNamerTests(BaseNamerTests):
         for version_suffix, expected_name, extra_options in expected:
             namer = self._get_namer(version_suffix, **extra_options)
             self.assertEqual(namer.get_version_name(), expected_name)
+
+
+class VersionNameCacheTests(BaseNamerTests):
+
+    def setUp(self):
+        super(VersionNameCacheTests, self).setUp()
+        namers._version_names.clear()
+
+    def test_namer_class(self):
+        with patch('filebrowser.namers.import_string', wraps=import_string) as mock_import:
+            namers.get_namer_class()
+            namers.get_namer_class()
+        self.assertLessEqual(mock_import.call_count, 1)
+        with patch('filebrowser.namers.VERSION_NAMER', 'filebrowser.namers.OptionsNamer'):
+            self.assertIs(namers.get_namer_class(), OptionsNamer)
+        self.assertIs(namers.get_namer_class(), VersionNamer)
+
+    @patch('filebrowser.namers.VERSION_NAMER', 'filebrowser.namers.OptionsNamer')
+    def test_cached(self):
+        with patch.object(OptionsNamer, 'get_version_name', autospec=True, side_effect=OptionsNamer.get_version_name) as mock_name:
+            self.assertEqual(self.F_IMAGE.version_name('small'), 'testimage_small--140x0.jpg')
+            self.assertEqual(self.F_IMAGE.version_name('small'), 'testimage_small--140x0.jpg')
+            self.assertEqual(mock_name.call_count, 1)
+            self.assertEqual(self.F_IMAGE.version_name('small', {'sepia': True}), 'testimage_small--140x0--sepia.jpg')
+            self.assertEqual(mock_name.call_count, 2)
+
+    @patch('filebrowser.namers.VERSION_NAMER', 'filebrowser.namers.OptionsNamer')
+    @patch('filebrowser.namers.VERSION_NAME_CACHE_SIZE', 2)
+    def test_bounded(self):
+        for version_suffix in ('small', 'medium', 'large'):
+            self.F_IMAGE.version_name(version_suffix)
+        self.assertEqual(len(namers._version_names), 2)
+
+    @patch('filebrowser.namers.VERSION_NAMER', 'filebrowser.namers.OptionsNamer')
+    @patch.object(OptionsNamer, 'cache_names', False)
+    def test_not_cached(self):
+        self.F_IMAGE.version_name('small')
+        self.assertEqual(len(namers._version_names), 0)
+
+    def test_frozen_options(self):
+        options = self.F_IMAGE._get_options('small')
+        self.assertIs(self.F_IMAGE._get_options('small'), options)
+        with self.assertRaises(TypeError):
+            options['width'] = 10
+        self.assertEqual(self.F_IMAGE._get_options('small', {'width': 10})['width'], 10)
+        self.assertEqual(self.F_IMAGE._get_options('small')['width'], 140)
+
+    def test_options_changed_in_place(self):
+        self.assertEqual(self.F_IMAGE._get_options('small')['width'], 140)
+        with patch.dict(VERSIONS['small'], {'width': 120}):
+            self.assertEqual(self.F_IMAGE._get_options('small')['width'], 120)
+        self.assertEqual(self.F_IMAGE._get_options('small')['width'], 140)
+
+    def test_options_setting_changed(self):
+        self.F_IMAGE._get_options('small')
+        self.assertIn('small', base._version_options)
+        with override_settings(FILEBROWSER_VERSION_QUALITY=50):
+            self.assertNotIn('small', base._version_options)
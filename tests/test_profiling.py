@@ -0,0 +1,73 @@
+import shutil
+
+from django.conf import settings
+from django.test import override_settings
+from django.urls import reverse
+
+from filebrowser import signals
+from filebrowser.base import FileListing
+from filebrowser.profiling import profile
+from filebrowser.sites import site
+from filebrowser.storage import InstrumentedStorage
+
+from . import FilebrowserTestCase as TestCase
+
+
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        super(ProfilingTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.storage = site.storage
+        site.storage = InstrumentedStorage(self.storage)
+
+    def tearDown(self):
+        site.storage = self.storage
+        super(ProfilingTests, self).tearDown()
+
+    def test_storage_calls(self):
+        with profile() as p:
+            FileListing(self.F_FOLDER.path, site=site).files_listing_total()
+        summary = p.summary()
+        self.assertEqual(summary['methods']['listdir']['count'], 1)
+        callers = [call['caller'] for call in summary['calls'] if call['method'] == 'listdir']
+        self.assertEqual(callers, ['filebrowser.base:FileListing.listing'])
+        self.assertIn('listdir=1;', str(p))
+
+    def test_no_profile(self):
+        # wrapped storages work without an active profile
+        self.assertTrue(site.storage.isfile(self.F_IMAGE.path))
+        self.assertEqual(site.storage.location, self.storage.location)
+
+    def test_version_stages(self):
+        with profile() as p:
+            self.F_IMAGE.version_generate('large')
+        self.assertEqual(set(p.stages), {'open', 'decode', 'process', 'encode', 'save'})
+        self.assertEqual(p.stages['encode'][0], 1)
+
+    def test_signals(self):
+        calls, stages = [], []
+
+        def storage_call_receiver(sender, method, **kwargs):
+            calls.append(method)
+
+        def version_stage_receiver(sender, stage, **kwargs):
+            stages.append(stage)
+
+        signals.filebrowser_storage_call.connect(storage_call_receiver)
+        signals.filebrowser_version_stage.connect(version_stage_receiver)
+        try:
+            self.F_IMAGE.version_generate('large')
+        finally:
+            signals.filebrowser_storage_call.disconnect(storage_call_receiver)
+            signals.filebrowser_version_stage.disconnect(version_stage_receiver)
+        self.assertIn('replace', calls)
+        self.assertIn('decode', stages)
+
+    def test_middleware(self):
+        middleware = settings.MIDDLEWARE + ['filebrowser.middleware.StorageProfilingMiddleware']
+        self.client.login(username=self.user.username, password='password')
+        with override_settings(MIDDLEWARE=middleware), self.assertLogs('filebrowser.profiling', 'INFO'):
+            response = self.client.get(reverse('filebrowser:fb_browse') + '?dir=folder')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('listdir=1;', response['X-FileBrowser-Profile'])
@@ -5,10 +5,12 @@ from unittest.mock import patch
 
 from django.urls import reverse
 from django.utils.http import urlencode
+from PIL import Image
 
 from filebrowser.settings import VERSIONS, DEFAULT_PERMISSIONS
 from filebrowser.base import FileObject
 from filebrowser.sites import site
+from filebrowser.utils import EXIF_ORIENTATION
 from . import FilebrowserTestCase as TestCase
 
 
@@ -36,6 +38,46 @@ class BrowseViewTests(TestCase):
         response = self.client.get(self.url + "?dir=folder&type=document")
         self.assertEqual(len(response.context['page'].object_list), 1)
 
+    @patch('filebrowser.sites.ADMIN_THUMBNAIL_SPRITES', True)
+    def test_sprite(self):
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        shutil.copy(self.STATIC_IMG_PATH, os.path.join(self.FOLDER_PATH, 'testimage2.jpg'))
+
+        # the thumbnails are generated with the first request, the sprite with the next one
+        response = self.client.get(self.url + "?dir=folder")
+        self.assertIsNone(response.context['sprite'])
+        response = self.client.get(self.url + "?dir=folder")
+        sprite = response.context['sprite']
+        self.assertEqual(sorted(sprite.offsets), [self.F_IMAGE.path, os.path.join(self.F_FOLDER.path, 'testimage2.jpg')])
+        self.assertContains(response, 'class="fb_sprite"', count=2)
+
+        # the sprite is cached (keyed by paths and modification times)
+        with patch.object(site.storage, 'replace', wraps=site.storage.replace) as mock_replace:
+            response = self.client.get(self.url + "?dir=folder")
+        self.assertFalse(mock_replace.called)
+        self.assertEqual(response.context['sprite'].url, sprite.url)
+
+        # one sprite per directory and page, replaced if the images change
+        sprites_path = os.path.join(self.VERSIONS_PATH, '_sprites', 'folder')
+        self.client.get(self.url + "?dir=folder&o=filename_lower&ot=asc")
+        os.utime(self.F_IMAGE.path_full, (0, 0))
+        self.client.get(self.url + "?dir=folder")
+        response = self.client.get(self.url + "?dir=folder")
+        self.assertNotEqual(response.context['sprite'].url, sprite.url)
+        self.assertEqual(len(os.listdir(sprites_path)), 2)
+
+        # deleted with the versions
+        self.F_IMAGE.delete_versions()
+        self.assertEqual(os.listdir(sprites_path), [])
+
+    @patch('filebrowser.sites.ADMIN_THUMBNAIL_SPRITES', True)
+    def test_sprite_transparency(self):
+        Image.new('RGBA', (100, 100), (255, 0, 0, 0)).save(os.path.join(self.FOLDER_PATH, 'transparent.png'))
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.client.get(self.url + "?dir=folder")
+        sprite = self.client.get(self.url + "?dir=folder").context['sprite']
+        self.assertEqual(list(sprite.offsets), [self.F_IMAGE.path])
+
     def test_ckeditor_params_in_search_form(self):
         """
         The CKEditor GET params must be included in the search form as hidden
@@ -182,6 +224,22 @@ class UploadFileViewTests(TestCase):
 
         self.assertEqual(len(site.storage.listdir(self.F_SUBFOLDER.path)[1]), 2)
 
+    @patch('filebrowser.sites.AUTO_ORIENT_UPLOADS', True)
+    def test_auto_orient_uploads(self):
+        rotated_path = os.path.join(self.TEST_PATH, 'rotated.jpg')
+        im = Image.new('RGB', (400, 200))
+        exif = im.getexif()
+        exif[EXIF_ORIENTATION] = 6
+        im.save(rotated_path, exif=exif)
+
+        url = '?'.join([self.url, urlencode({'folder': self.F_SUBFOLDER.path_relative_directory})])
+        with open(rotated_path, "rb") as f:
+            self.client.post(url, data={'qqfile': 'rotated.jpg', 'file': f}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        uploaded = Image.open(os.path.join(self.SUBFOLDER_PATH, 'rotated.jpg'))
+        self.assertEqual(uploaded.size, (200, 400))
+        self.assertEqual(uploaded.getexif().get(EXIF_ORIENTATION, 1), 1)
+
     @patch('filebrowser.utils.CONVERT_FILENAME', False)
     @patch('filebrowser.utils.NORMALIZE_FILENAME', False)
     def test_convert_false_normalize_false(self):
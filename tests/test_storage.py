@@ -0,0 +1,167 @@
+import mmap
+import os
+import shutil
+from unittest.mock import patch
+
+from django.core.files.base import ContentFile
+
+from filebrowser.base import FileObject
+from filebrowser.sites import site
+from filebrowser.sources import open_source
+from filebrowser.storage import StorageMixin
+from filebrowser.utils import get_modified_time
+
+from . import FilebrowserTestCase as TestCase
+
+
+class StatTests(TestCase):
+
+    def setUp(self):
+        super(StatTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+
+    def test_stat(self):
+        result = site.storage.stat(self.F_IMAGE.path)
+        self.assertEqual((result.exists, result.is_dir, result.size, result.etag), (True, False, 870037, None))
+        self.assertEqual(result.mtime, get_modified_time(site.storage, self.F_IMAGE.path))
+        self.assertTrue(site.storage.stat(self.F_FOLDER.path).is_dir)
+        self.assertFalse(site.storage.stat(self.F_MISSING.path).exists)
+
+    def test_default_stat(self):
+        result = StorageMixin.stat(site.storage, self.F_IMAGE.path)
+        self.assertEqual(result, (True, False, None, None, None))
+        self.assertEqual(StorageMixin.stat(site.storage, self.F_MISSING.path), (False, False, None, None, None))
+
+    def test_fileobject(self):
+        fileobject = FileObject(self.F_IMAGE.path, site=site)
+        with patch.object(site.storage, 'size') as mock_size, \
+                patch.object(site.storage, 'get_modified_time') as mock_modified_time, \
+                patch.object(site.storage, 'isdir') as mock_isdir, \
+                patch.object(site.storage, 'exists') as mock_exists:
+            self.assertEqual(fileobject.filesize, 870037)
+            self.assertTrue(fileobject.date)
+            self.assertTrue(fileobject.exists)
+            self.assertFalse(fileobject.is_folder)
+        for mock in (mock_size, mock_modified_time, mock_isdir, mock_exists):
+            self.assertFalse(mock.called)
+
+    def test_fileobject_default_stat(self):
+        fileobject = FileObject(self.F_IMAGE.path, site=site)
+        with patch.object(site.storage, 'stat', lambda name: StorageMixin.stat(site.storage, name)):
+            self.assertEqual(fileobject.filesize, 870037)
+            self.assertEqual(fileobject.date, FileObject(self.F_IMAGE.path, site=site).date)
+
+
+class ReplaceTests(TestCase):
+
+    def setUp(self):
+        super(ReplaceTests, self).setUp()
+        self.path = os.path.join(self.F_FOLDER.path, 'file.txt')
+        with open(site.storage.path(self.path), 'wb') as f:
+            f.write(b'old')
+
+    def test_replace(self):
+        with patch.object(site.storage, 'delete') as mock_delete:
+            self.assertEqual(site.storage.replace(self.path, ContentFile(b'new')), self.path)
+        self.assertFalse(mock_delete.called)
+        with open(site.storage.path(self.path), 'rb') as f:
+            self.assertEqual(f.read(), b'new')
+        self.assertEqual(sorted(os.listdir(self.FOLDER_PATH)), ['file.txt', 'subfolder'])
+
+    def test_replace_new_directory(self):
+        path = os.path.join(self.F_FOLDER.path, 'new', 'file.txt')
+        site.storage.replace(path, ContentFile(b'new'))
+        self.assertTrue(site.storage.isfile(path))
+
+    def test_default_replace(self):
+        StorageMixin.replace(site.storage, self.path, ContentFile(b'new'))
+        with open(site.storage.path(self.path), 'rb') as f:
+            self.assertEqual(f.read(), b'new')
+        self.assertEqual(sorted(os.listdir(self.FOLDER_PATH)), ['file.txt', 'subfolder'])
+
+
+@patch('filebrowser.sources.get_local_path', lambda storage, path: None)
+class SourceCacheTests(TestCase):
+    "Originals of storages without local files (simulated by patching get_local_path)"
+
+    def setUp(self):
+        super(SourceCacheTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.CACHE_PATH = os.path.join(self.TEST_PATH, 'cache')
+        patcher = patch('filebrowser.sources.SOURCE_CACHE_DIR', self.CACHE_PATH)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read(self, fileobject):
+        with patch.object(site.storage, 'open', wraps=site.storage.open) as mock_open:
+            with open_source(fileobject) as f:
+                self.assertEqual(f.size, 870037)
+                content = f.read()
+        return content, mock_open.call_count
+
+    def test_cache(self):
+        content, downloads = self.read(FileObject(self.F_IMAGE.path, site=site))
+        self.assertEqual((len(content), downloads), (870037, 1))
+        self.assertEqual(len(os.listdir(self.CACHE_PATH)), 1)
+        content, downloads = self.read(FileObject(self.F_IMAGE.path, site=site))
+        self.assertEqual((len(content), downloads), (870037, 0))
+
+    def test_changed_original(self):
+        self.read(FileObject(self.F_IMAGE.path, site=site))
+        cached = os.listdir(self.CACHE_PATH)
+        os.utime(site.storage.path(self.F_IMAGE.path), (0, 0))
+        content, downloads = self.read(FileObject(self.F_IMAGE.path, site=site))
+        self.assertEqual(downloads, 1)
+        # the outdated copy has been removed
+        self.assertEqual(len(os.listdir(self.CACHE_PATH)), 1)
+        self.assertNotEqual(os.listdir(self.CACHE_PATH), cached)
+
+    def test_eviction(self):
+        shutil.copy(self.STATIC_IMG_PATH, os.path.join(self.FOLDER_PATH, 'copy.jpg'))
+        copy = FileObject(os.path.join(self.F_FOLDER.path, 'copy.jpg'), site=site)
+        with patch('filebrowser.sources.SOURCE_CACHE_MAX_SIZE', 870037 * 3 // 2):
+            self.read(FileObject(self.F_IMAGE.path, site=site))
+            os.utime(os.path.join(self.CACHE_PATH, os.listdir(self.CACHE_PATH)[0]), (0, 0))
+            self.read(copy)
+            self.assertEqual(len(os.listdir(self.CACHE_PATH)), 1)
+            self.assertEqual(self.read(copy)[1], 0)
+            self.assertEqual(self.read(FileObject(self.F_IMAGE.path, site=site))[1], 1)
+
+    def test_too_large(self):
+        with patch('filebrowser.sources.SOURCE_CACHE_MAX_SIZE', 1000):
+            self.assertEqual(self.read(self.F_IMAGE)[1], 1)
+        self.assertFalse(os.path.exists(self.CACHE_PATH))
+
+    def test_disabled(self):
+        with patch('filebrowser.sources.SOURCE_CACHE_DIR', None):
+            self.assertEqual(self.read(self.F_IMAGE)[1], 1)
+            self.assertEqual(self.read(self.F_IMAGE)[1], 1)
+
+    def test_versions(self):
+        with patch.object(site.storage, 'open', wraps=site.storage.open) as mock_open:
+            self.F_IMAGE.version_generate('large')
+            FileObject(self.F_IMAGE.path, site=site).version_generate('big')
+        self.assertEqual(mock_open.call_count, 1)
+        self.assertEqual(len(os.listdir(self.CACHE_PATH)), 1)
+
+
+class SourceMappedTests(TestCase):
+
+    def setUp(self):
+        super(SourceMappedTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+
+    def test_local(self):
+        with patch.object(site.storage, 'open') as mock_open:
+            with open_source(self.F_IMAGE) as f:
+                self.assertIsInstance(f.file, mmap.mmap)
+                self.assertEqual(f.size, 870037)
+                self.assertEqual(f.read(2), b'\xff\xd8')
+        self.assertFalse(mock_open.called)
+        self.assertEqual(self.F_IMAGE.dimensions, (1000, 750))
+
+    def test_empty(self):
+        path = os.path.join(self.F_FOLDER.path, 'empty.txt')
+        open(site.storage.path(path), 'wb').close()
+        with open_source(FileObject(path, site=site)) as f:
+            self.assertEqual(f.read(), b'')
@@ -1,22 +1,39 @@
+import base64
+import json
 import os
 import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO
 from unittest.mock import patch
 
 from django.conf import settings
+from django.core.cache import caches
+from django.core.files.storage import FileSystemStorage
 from django.template import Context, Template, TemplateSyntaxError
-
-from filebrowser.settings import STRICT_PIL
-from filebrowser import utils
-from filebrowser.utils import scale_and_crop, process_image
+from django.urls import reverse
+
+from filebrowser.base import FileObject, fileobject_registry
+from filebrowser.metadata import get_metadata
+from filebrowser.profiling import profile
+from filebrowser.settings import STRICT_PIL, VERSIONS
+from filebrowser.sites import site
+from filebrowser.storage import StorageMixin
+from filebrowser import manifest, sources, utils, workers
+from filebrowser.utils import auto_orient, scale_and_crop, process_image
 from . import FilebrowserTestCase as TestCase
 
 if STRICT_PIL:
-    from PIL import Image
+    from PIL import Image, ImageDraw, ImageOps, ImageStat
 else:
     try:
-        from PIL import Image
+        from PIL import Image, ImageDraw, ImageOps, ImageStat
     except ImportError:
         import Image
+        import ImageDraw
+        import ImageOps
+        import ImageStat
 
 
 def processor_mark_1(im, **kwargs):
@@ -29,6 +46,22 @@ def processor_mark_2(im, **kwargs):
     return im
 
 
+def processor_invert_in_place(im, **kwargs):
+    im.paste(ImageOps.invert(im.convert('RGB')))
+    return im
+
+
+def processor_watermark_in_place(im, **kwargs):
+    ImageDraw.Draw(im).rectangle((0, 0, 9, 9), fill=(0, 0, 255, 255))
+    return im
+
+
+def processor_noop(im, **kwargs):
+    return im
+
+processor_noop.pure = True
+
+
 class ImageProcessorsTests(TestCase):
     def setUp(self):
         super(ImageProcessorsTests, self).setUp()
@@ -167,6 +200,64 @@ class ScaleAndCropTests(TestCase):
         self.assertEqual(version.size, (500, 375))
 
 
+class AutoOrientTests(TestCase):
+    def setUp(self):
+        super(AutoOrientTests, self).setUp()
+        self.rotated_path = os.path.join(self.FOLDER_PATH, 'rotated.jpg')
+        im = Image.new('RGB', (400, 200))
+        exif = im.getexif()
+        exif[utils.EXIF_ORIENTATION] = 6
+        im.save(self.rotated_path, exif=exif)
+
+    def test_no_orientation(self):
+        im = Image.new('RGB', (400, 200))
+        self.assertIs(auto_orient(im), im)
+
+    def test_rotate(self):
+        im = Image.open(self.rotated_path)
+        self.assertEqual(auto_orient(im).size, (200, 400))
+
+    def test_version_generate(self):
+        f = FileObject(os.path.join(self.DIRECTORY, 'folder', 'rotated.jpg'), site=site)
+        version = f.version_generate('small')
+        self.assertEqual(version.dimensions, (140, 280))
+
+
+class VersionFormatTests(TestCase):
+    PATCH_VERSIONS = {
+        'small': {'verbose_name': 'Small (2 col)', 'width': 140, 'height': '', 'opts': '', 'format': 'webp', 'format_options': {'method': 0}},
+        'unknown': {'verbose_name': 'Unknown', 'width': 140, 'height': '', 'opts': '', 'format': 'xyz'},
+    }
+
+    def setUp(self):
+        super(VersionFormatTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+
+    @patch('filebrowser.base.VERSIONS', PATCH_VERSIONS)
+    @patch('filebrowser.namers.VERSIONS', PATCH_VERSIONS)
+    def test_version_generate(self):
+        self.assertEqual(self.F_IMAGE.version_name('small'), 'testimage_small.jpg.webp')
+        version = self.F_IMAGE.version_generate('small')
+        self.assertEqual(version.path, '_test/_versions/folder/testimage_small.jpg.webp')
+        self.assertEqual(Image.open(version.path_full).format, 'WEBP')
+        self.assertEqual(version.filetype, 'Image')
+        self.assertTrue(version.is_version)
+        self.assertEqual(version.original_filename, 'testimage.jpg')
+        self.assertEqual(version.original.path, self.F_IMAGE.path)
+
+    @patch('filebrowser.base.VERSIONS', PATCH_VERSIONS)
+    @patch('filebrowser.namers.VERSIONS', PATCH_VERSIONS)
+    @patch('filebrowser.namers.VERSION_NAMER', 'filebrowser.namers.OptionsNamer')
+    def test_version_generate_options_namer(self):
+        version = self.F_IMAGE.version_generate('small')
+        self.assertEqual(version.filename, 'testimage_small--140x0--format-webp.jpg.webp')
+        self.assertEqual(version.original_filename, 'testimage.jpg')
+
+    @patch('filebrowser.base.VERSIONS', PATCH_VERSIONS)
+    def test_unsupported_format(self):
+        self.assertEqual(self.F_IMAGE.version_name('unknown'), 'testimage_unknown.jpg')
+
+
 class VersionTemplateTagTests(TestCase):
     """Test basic version uses
 
@@ -256,6 +347,16 @@ class VersionTemplateTagTests(TestCase):
         r = t.render(c)
         self.assertEqual(r, os.path.join(settings.MEDIA_URL, "_test/_versions/placeholders/testimage_large.jpg"))
 
+    @patch('filebrowser.templatetags.fb_versions.SHOW_PLACEHOLDER', True)
+    def test_placeholder_check_uses_registry(self):
+        t = Template('{% load fb_versions %}{% version obj.path "large" %}{% version obj.path "small" %}')
+        with fileobject_registry(), \
+                patch.object(site.storage, 'stat', wraps=site.storage.stat) as mock_stat, \
+                patch.object(site.storage, 'isfile', wraps=site.storage.isfile) as mock_isfile:
+            t.render(Context({"obj": self.F_IMAGE}))
+        self.assertEqual([c[0][0] for c in mock_stat.call_args_list].count(self.F_IMAGE.path), 1)
+        self.assertFalse(mock_isfile.called)
+
     # def test_permissions(self):
     # FIXME: Test permissions by creating file AFTER we patch DEFAULT_PERMISSIONS
     #     permissions_file = oct(os.stat(os.path.join(settings.MEDIA_ROOT, "_test/_versions/folder/testimage_large.jpg")).st_mode & 0o777)
@@ -441,3 +542,725 @@ class VersionObjectTemplateTagTests(TestCase):
         r = t.render(c)
         self.assertEqual(c["version_large"].url, os.path.join(settings.MEDIA_URL, "_test/_versions/placeholders/testimage_large.jpg"))
         self.assertEqual(r, os.path.join(settings.MEDIA_URL, "_test/_versions/placeholders/testimage_large.jpg"))
+
+
+class VersionSrcsetTemplateTagTests(TestCase):
+
+    def setUp(self):
+        super(VersionSrcsetTemplateTagTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+
+    def test_wrong_token(self):
+        self.assertRaises(TemplateSyntaxError, lambda: Template('{% load fb_versions %}{% version_srcset obj %}'))
+        self.assertRaises(TemplateSyntaxError, lambda: Template('{% load fb_versions %}{% version_srcset obj "small" to var %}'))
+
+    def test_srcset(self):
+        t = Template('{% load fb_versions %}{% version_srcset obj "small,medium,invalid" %}')
+        c = Context({"obj": self.F_IMAGE})
+        r = t.render(c)
+        self.assertEqual(r, "%s 140w, %s 300w" % (
+            os.path.join(settings.MEDIA_URL, "_test/_versions/folder/testimage_small.jpg"),
+            os.path.join(settings.MEDIA_URL, "_test/_versions/folder/testimage_medium.jpg")))
+
+    def test_srcset_small_original(self):
+        Image.new('RGB', (100, 75)).save(os.path.join(self.FOLDER_PATH, 'small.jpg'))
+        t = Template('{% load fb_versions %}{% version_srcset obj "thumbnail,small,medium,large" %}')
+        r = t.render(Context({"obj": FileObject(os.path.join(self.F_FOLDER.path, 'small.jpg'), site=site)}))
+        # real widths, versions with the same width are not repeated
+        self.assertEqual(r, "%s 60w, %s 100w" % (
+            os.path.join(settings.MEDIA_URL, "_test/_versions/folder/small_thumbnail.jpg"),
+            os.path.join(settings.MEDIA_URL, "_test/_versions/folder/small_small.jpg")))
+
+    def test_srcset_as_var(self):
+        t = Template('{% load fb_versions %}{% version_srcset obj.path suffixes as srcset %}{{ srcset }}')
+        c = Context({"obj": self.F_IMAGE, "suffixes": ["big"]})
+        r = t.render(c)
+        self.assertEqual(c["srcset"], "%s 460w" % os.path.join(settings.MEDIA_URL, "_test/_versions/folder/testimage_big.jpg"))
+        self.assertEqual(r, c["srcset"])
+
+    def test_opens_original_once(self):
+        with patch('filebrowser.base.open_source', wraps=sources.open_source) as mock_open:
+            self.F_IMAGE.versions_generate(['small', 'medium', 'big'])
+            self.assertEqual(mock_open.call_count, 1)
+            # versions are up to date
+            self.F_IMAGE.versions_generate(['small', 'medium', 'big'])
+            self.assertEqual(mock_open.call_count, 1)
+
+    @patch('filebrowser.utils.VERSION_PROCESSORS', [
+        'tests.test_versions.processor_invert_in_place',
+        'filebrowser.utils.scale_and_crop',
+    ])
+    def test_processor_modifying_in_place(self):
+        utils._default_processors = None
+        self.addCleanup(setattr, utils, '_default_processors', None)
+        with Image.open(self.F_IMAGE.path_full) as im:
+            inverted = 255 - ImageStat.Stat(im).mean[0]
+        versions = self.F_IMAGE.versions_generate(['small', 'medium', 'big'])
+        # every version is generated from the unmodified original
+        for version in versions:
+            with Image.open(version.path_full) as im:
+                self.assertAlmostEqual(ImageStat.Stat(im).mean[0], inverted, delta=3)
+
+    def test_non_existing_path(self):
+        t = Template('{% load fb_versions %}{% version_srcset obj "small,medium" %}')
+        c = Context({"obj": self.F_MISSING})
+        self.assertEqual(t.render(c), "")
+
+
+class LQIPTests(TestCase):
+
+    def setUp(self):
+        super(LQIPTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        caches['default'].clear()
+
+    @patch('filebrowser.base.LQIP', True)
+    def test_version_generate(self):
+        self.F_IMAGE.version_generate('small')
+        lqip = get_metadata(self.F_IMAGE)['lqip']
+        self.assertTrue(lqip.startswith('data:image/jpeg;base64,'))
+        im = Image.open(BytesIO(base64.b64decode(lqip.split(',', 1)[1])))
+        self.assertEqual(max(im.size), 20)
+
+        # served from the metadata cache
+        with patch.object(site.storage, 'open', wraps=site.storage.open) as mock_open:
+            f = FileObject(self.F_IMAGE.path, site=site)
+            self.assertEqual(f.lqip, lqip)
+            self.assertFalse(mock_open.called)
+
+    @patch('filebrowser.base.LQIP', True)
+    def test_without_versions(self):
+        self.assertTrue(self.F_IMAGE.lqip.startswith('data:image/jpeg;base64,'))
+        self.assertEqual(get_metadata(self.F_IMAGE)['lqip'], self.F_IMAGE.lqip)
+        self.assertIsNone(self.F_FOLDER.lqip)
+
+    def test_disabled(self):
+        self.F_IMAGE.version_generate('small')
+        self.assertIsNone(self.F_IMAGE.lqip)
+
+    @patch('filebrowser.base.LQIP', True)
+    def test_filter(self):
+        t = Template('{% load fb_versions %}{{ obj|lqip }}')
+        self.assertTrue(t.render(Context({"obj": self.F_IMAGE})).startswith('data:image/jpeg;base64,'))
+        self.assertTrue(t.render(Context({"obj": self.F_IMAGE.path})).startswith('data:image/jpeg;base64,'))
+        self.assertEqual(t.render(Context({"obj": ""})), "")
+
+    def test_orientation(self):
+        path = os.path.join(self.FOLDER_PATH, 'rotated.jpg')
+        im = Image.new('RGB', (400, 200))
+        exif = im.getexif()
+        exif[utils.EXIF_ORIENTATION] = 6
+        im.save(path, exif=exif)
+        lqip = utils.get_lqip(Image.open(path))
+        self.assertEqual(Image.open(BytesIO(base64.b64decode(lqip.split(',', 1)[1]))).size, (10, 20))
+
+
+@patch('filebrowser.base.VERSION_ANALYZERS', ['filebrowser.utils.phash', 'filebrowser.utils.dominant_color'])
+class VersionAnalyzersTests(TestCase):
+
+    def setUp(self):
+        super(VersionAnalyzersTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        caches['default'].clear()
+
+    def test_version_generate(self):
+        self.F_IMAGE.version_generate('small')
+        metadata = get_metadata(self.F_IMAGE)
+        self.assertEqual(len(metadata['phash']), 16)
+        self.assertRegex(metadata['dominant_color'], r'^#[0-9a-f]{6}$')
+
+        # served from the metadata cache
+        with patch.object(site.storage, 'open', wraps=site.storage.open) as mock_open:
+            f = FileObject(self.F_IMAGE.path, site=site)
+            self.assertEqual(f.phash, metadata['phash'])
+            self.assertEqual(f.dominant_color, metadata['dominant_color'])
+            self.assertFalse(mock_open.called)
+
+    def test_phash(self):
+        im = Image.open(self.STATIC_IMG_PATH)
+        h1 = utils.phash(im)['phash']
+        h2 = utils.phash(im.resize((im.size[0] // 3, im.size[1] // 3)))['phash']
+        h3 = utils.phash(im.transpose(Image.Transpose.ROTATE_90))['phash']
+        self.assertLessEqual(utils.hamming_distance(h1, h2), 10)
+        self.assertGreater(utils.hamming_distance(h1, h3), 10)
+
+    def test_dominant_color(self):
+        im = Image.new('RGB', (100, 100), (255, 0, 0))
+        im.paste((0, 0, 255), (0, 0, 10, 10))
+        self.assertEqual(utils.dominant_color(im), {'dominant_color': '#ff0000'})
+
+    def test_similar(self):
+        im = Image.open(self.STATIC_IMG_PATH)
+        im.resize((im.size[0] // 2, im.size[1] // 2)).save(os.path.join(self.FOLDER_PATH, 'similar.jpg'))
+        im.transpose(Image.Transpose.ROTATE_90).save(os.path.join(self.FOLDER_PATH, 'rotated.jpg'))
+        for filename in ('similar.jpg', 'rotated.jpg'):
+            FileObject(os.path.join(self.DIRECTORY, 'folder', filename), site=site).version_generate('small')
+
+        self.client.login(username=self.user.username, password='password')
+        response = self.client.get(reverse('filebrowser:fb_browse') + '?dir=folder&similar=folder/testimage.jpg')
+        filenames = [f.filename for f in response.context['page'].object_list if f.filetype == "Image"]
+        self.assertEqual(sorted(filenames), ['similar.jpg', 'testimage.jpg'])
+
+        response = self.client.get(reverse('filebrowser:fb_detail') + '?dir=folder&filename=testimage.jpg')
+        self.assertContains(response, '&amp;similar=folder/testimage.jpg')
+
+
+class PixelBudgetTests(TestCase):
+
+    def setUp(self):
+        super(PixelBudgetTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+
+    def test_required_size(self):
+        size = (1000, 750)
+        self.assertEqual(utils.get_required_size(size, [{'width': 200}]), (200, 150))
+        self.assertEqual(utils.get_required_size(size, [{'width': 200}, {'width': 300}]), (300, 225))
+        self.assertEqual(utils.get_required_size(size, [{'width': 60, 'height': 60, 'opts': 'crop'}]), (80, 60))
+        self.assertEqual(utils.get_required_size(size, [{'width': 140}, {'width': 2000}]), size)
+        self.assertEqual(utils.get_required_size(size, [{'width': 140}, {}]), size)
+
+    def test_fit_pixel_budget(self):
+        im = Image.open(self.STATIC_IMG_PATH)
+        self.assertTrue(utils.fit_pixel_budget(im, 1000000, (200, 150)))
+        self.assertEqual(im.size, (1000, 750))
+        # decoded with 1/4 of the size
+        self.assertTrue(utils.fit_pixel_budget(im, 100000, (200, 150)))
+        self.assertEqual(im.size, (250, 188))
+        im = Image.open(self.STATIC_IMG_PATH)
+        self.assertFalse(utils.fit_pixel_budget(im, 100000, (680, 510)))
+
+    @patch('filebrowser.base.VERSION_MAX_PIXELS', 100000)
+    def test_version_generate(self):
+        version = self.F_IMAGE.version_generate('small')
+        self.assertEqual(version.dimensions[0], 140)
+
+    @patch('filebrowser.base.VERSION_MAX_PIXELS', 100000)
+    def test_refused(self):
+        # PNGs are not decoded with a reduced size
+        Image.new('RGB', (400, 300)).save(os.path.join(self.FOLDER_PATH, 'large.png'))
+        f = FileObject(os.path.join(self.DIRECTORY, 'folder', 'large.png'), site=site)
+        self.assertEqual(f.version_generate('small').path, "")
+        # JPEGs which are still too large after reducing the size
+        self.assertEqual(self.F_IMAGE.version_generate('large').path, "")
+
+    @patch('filebrowser.base.VERSION_MAX_PIXELS', 100000)
+    @patch('filebrowser.base.LQIP', True)
+    def test_metadata(self):
+        caches['default'].clear()
+        # JPEGs are decoded with a reduced size
+        with patch.object(Image.Image, 'load', autospec=True, side_effect=Image.Image.load) as mock_load:
+            self.assertTrue(self.F_IMAGE.lqip.startswith('data:image/jpeg;base64,'))
+        self.assertIn((125, 94), [call[0][0].size for call in mock_load.call_args_list])
+        self.assertNotIn((1000, 750), [call[0][0].size for call in mock_load.call_args_list])
+        # other images are refused (and not opened again)
+        Image.new('RGB', (400, 300)).save(os.path.join(self.FOLDER_PATH, 'large.png'))
+        path = os.path.join(self.DIRECTORY, 'folder', 'large.png')
+        self.assertIsNone(FileObject(path, site=site).lqip)
+        with patch('filebrowser.base.open_source') as mock_open:
+            self.assertIsNone(FileObject(path, site=site).lqip)
+        self.assertFalse(mock_open.called)
+
+    @patch('filebrowser.base.VERSION_MAX_PIXELS', 100000)
+    @patch('filebrowser.templatetags.fb_versions.SHOW_PLACEHOLDER', True)
+    def test_placeholder(self):
+        os.makedirs(self.PLACEHOLDER_PATH)
+        Image.new('RGB', (200, 150)).save(os.path.join(self.PLACEHOLDER_PATH, 'testimage.jpg'))
+        t = Template('{% load fb_versions %}{% version obj "large" %}')
+        r = t.render(Context({"obj": self.F_IMAGE}))
+        self.assertEqual(r, os.path.join(settings.MEDIA_URL, "_test/_versions/placeholders/testimage_large.jpg"))
+
+
+class VersionLockTests(TestCase):
+
+    def setUp(self):
+        super(VersionLockTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+
+    def test_file_lock(self):
+        with site.storage.lock('_test/lock', 0) as acquired:
+            self.assertTrue(acquired)
+            with site.storage.lock('_test/lock', 0) as acquired_again:
+                self.assertFalse(acquired_again)
+        with site.storage.lock('_test/lock', 0) as acquired:
+            self.assertTrue(acquired)
+
+    def test_no_lock_files(self):
+        lock_dir = os.path.join(tempfile.gettempdir(), 'filebrowser-locks')
+        existing = set(os.listdir(lock_dir)) if os.path.isdir(lock_dir) else set()
+        with site.storage.lock('_test/lock', 0) as acquired:
+            self.assertTrue(acquired)
+            self.assertEqual(len(set(os.listdir(lock_dir)) - existing), 1)
+        self.assertEqual(set(os.listdir(lock_dir)) - existing, set())
+
+    def test_file_lock_exclusive(self):
+        # the lock file is removed and created again while threads are waiting
+        holders = []
+        overlaps = []
+
+        def worker():
+            for i in range(20):
+                with site.storage.lock('_test/lock', 5) as acquired:
+                    self.assertTrue(acquired)
+                    holders.append(1)
+                    if len(holders) > 1:
+                        overlaps.append(1)
+                    time.sleep(0.001)
+                    holders.pop()
+
+        threads = [threading.Thread(target=worker) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(overlaps, [])
+
+    def test_cache_lock(self):
+        with StorageMixin.lock(site.storage, '_test/lock', 0) as acquired:
+            self.assertTrue(acquired)
+            with StorageMixin.lock(site.storage, '_test/lock', 0.1) as acquired_again:
+                self.assertFalse(acquired_again)
+        with StorageMixin.lock(site.storage, '_test/lock', 0) as acquired:
+            self.assertTrue(acquired)
+
+    @patch('filebrowser.base.VERSION_LOCK_TIMEOUT', 0)
+    def test_locked(self):
+        version_path = self.F_IMAGE.version_path('small')
+        # another process is generating the version
+        with site.storage.lock(version_path, 0):
+            self.assertEqual(self.F_IMAGE.version_generate('small').path, "")
+        self.assertEqual(self.F_IMAGE.version_generate('small').path, version_path)
+
+    def test_no_temporary_files(self):
+        self.F_IMAGE.version_generate('small')
+        self.F_IMAGE.version_generate('big')
+        os.utime(self.F_IMAGE.path_full, (0, time.time() + 10))
+        FileObject(self.F_IMAGE.path, site=site).version_generate('small')
+        self.assertEqual(sorted(os.listdir(os.path.join(self.VERSIONS_PATH, 'folder'))), ['testimage_big.jpg', 'testimage_small.jpg'])
+
+
+class EncodeBufferTests(TestCase):
+
+    def test_in_memory(self):
+        buf = utils.EncodeBuffer(max_size=1024 * 1024)
+        Image.new('RGB', (100, 100)).save(buf, format='JPEG')
+        self.assertFalse(buf._rolled)
+        self.assertGreater(buf.tell(), 0)
+
+    def test_rollover(self):
+        buf = utils.EncodeBuffer(max_size=100)
+        Image.new('RGB', (100, 100)).save(buf, format='PNG')
+        self.assertTrue(buf._rolled)
+
+    @patch('filebrowser.utils.ENCODE_BUFFER_MAX_SIZE', 0)
+    def test_version_generate(self):
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        # no limit
+        version = self.F_IMAGE.version_generate('small')
+        self.assertEqual(version.dimensions[0], 140)
+
+
+@patch('filebrowser.base.VERSION_MANIFEST', True)
+class VersionManifestTests(TestCase):
+
+    def setUp(self):
+        super(VersionManifestTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        manifest._manifests.clear()
+        self.manifest_path = manifest.get_manifest_path(self.F_IMAGE.version_path('small'))
+
+    def get_manifest(self):
+        with site.storage.open(self.manifest_path) as f:
+            return json.loads(f.read().decode('utf-8'))
+
+    def test_generate(self):
+        version = self.F_IMAGE.version_generate('small')
+        entry = self.get_manifest()['testimage_small.jpg']
+        self.assertEqual(entry['source_mtime'], self.F_IMAGE.date)
+        self.assertEqual(entry['size'], version.filesize)
+        with patch.object(site.storage, 'stat', wraps=site.storage.stat) as mock_stat, \
+                patch.object(site.storage, 'open', wraps=site.storage.open) as mock_open:
+            self.assertEqual(self.F_IMAGE.version_generate('small').path, version.path)
+        self.assertFalse(mock_stat.called)
+        self.assertFalse(mock_open.called)
+
+    def test_existing_versions(self):
+        with patch('filebrowser.base.VERSION_MANIFEST', False):
+            self.F_IMAGE.versions_generate(['small', 'large'])
+        self.assertFalse(site.storage.exists(self.manifest_path))
+        self.F_IMAGE.versions_generate(['small', 'large'])
+        self.assertEqual(sorted(self.get_manifest()), ['testimage_large.jpg', 'testimage_small.jpg'])
+
+    def test_modified_original(self):
+        self.F_IMAGE.version_generate('small')
+        os.utime(self.F_IMAGE.path_full, (0, time.time() + 10))
+        fileobject = FileObject(self.F_IMAGE.path, site=site)
+        with patch.object(FileObject, '_generate_version', autospec=True, side_effect=FileObject._generate_version) as mock_generate:
+            fileobject.version_generate('small')
+        self.assertTrue(mock_generate.called)
+        self.assertEqual(self.get_manifest()['testimage_small.jpg']['source_mtime'], fileobject.date)
+
+    def test_extra_options(self):
+        self.F_IMAGE.version_generate('small')
+        options = self.F_IMAGE._get_options('small', {'width': 100})
+        self.assertFalse(manifest.is_fresh(self.get_manifest(), self.F_IMAGE, self.F_IMAGE.version_path('small'), options))
+
+    def test_delete_versions(self):
+        self.F_IMAGE.versions_generate(['small', 'large'])
+        self.F_IMAGE.delete_versions()
+        self.assertEqual(self.get_manifest(), {})
+        self.assertEqual(manifest.get_manifest(site, self.manifest_path), {})
+
+    def test_changed_options(self):
+        self.F_IMAGE.version_generate('small')
+        with patch('filebrowser.manifest.VERSION_QUALITY', 50), \
+                patch.object(FileObject, '_generate_version', autospec=True, side_effect=FileObject._generate_version) as mock_generate:
+            self.F_IMAGE.version_generate('small')
+            self.F_IMAGE.version_generate('small')
+        self.assertEqual(mock_generate.call_count, 1)
+
+    def test_changed_verbose_name(self):
+        self.F_IMAGE.version_generate('small')
+        versions = dict(VERSIONS, small=dict(VERSIONS['small'], verbose_name='Small'))
+        with patch('filebrowser.base.VERSIONS', versions):
+            self.assertTrue(self.F_IMAGE.version_exists('small'))
+
+    def test_force(self):
+        self.F_IMAGE.version_generate('small')
+        with patch.object(FileObject, '_generate_version', autospec=True, side_effect=FileObject._generate_version) as mock_generate:
+            self.F_IMAGE.version_generate('small', force=True)
+        self.assertTrue(mock_generate.called)
+
+    def test_removed_version(self):
+        version = self.F_IMAGE.version_generate('small')
+        # removed without updating the manifest (e.g. a purge of the storage)
+        os.remove(version.path_full)
+        manifest._manifests.clear()
+        self.assertFalse(self.F_IMAGE.version_exists('small'))
+        self.assertTrue(os.path.isfile(self.F_IMAGE.version_generate('small').path_full))
+        self.assertIn('testimage_small.jpg', self.get_manifest())
+
+    def test_one_update(self):
+        with patch('filebrowser.manifest.update_manifest', wraps=manifest.update_manifest) as mock_update:
+            self.F_IMAGE.versions_generate(['small', 'medium', 'large'])
+        self.assertEqual(mock_update.call_count, 1)
+        self.assertEqual(sorted(self.get_manifest()), ['testimage_large.jpg', 'testimage_medium.jpg', 'testimage_small.jpg'])
+
+    @patch('filebrowser.manifest.VERSION_LOCK_TIMEOUT', 0)
+    def test_locked(self):
+        # another process keeps the manifest locked
+        with site.storage.lock(self.manifest_path, 0), self.assertLogs('filebrowser.manifest', 'WARNING'):
+            self.F_IMAGE.version_generate('small')
+        self.assertFalse(site.storage.exists(self.manifest_path))
+        # kept in memory
+        with patch.object(FileObject, '_generate_version', autospec=True, side_effect=FileObject._generate_version) as mock_generate:
+            self.F_IMAGE.version_generate('small')
+        self.assertFalse(mock_generate.called)
+        # found with the storage
+        manifest._manifests.clear()
+        with patch.object(FileObject, '_generate_version', autospec=True, side_effect=FileObject._generate_version) as mock_generate:
+            self.F_IMAGE.version_generate('small')
+        self.assertFalse(mock_generate.called)
+        self.assertEqual(sorted(self.get_manifest()), ['testimage_small.jpg'])
+
+
+class UnchangedOriginalTests(TestCase):
+
+    def setUp(self):
+        super(UnchangedOriginalTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.icon_path = os.path.join(self.FOLDER_PATH, 'icon.png')
+        Image.new('RGBA', (40, 30), (255, 0, 0, 128)).save(self.icon_path)
+        self.icon = FileObject(os.path.join(self.F_FOLDER.path, 'icon.png'), site=site)
+
+    def read(self, path):
+        with site.storage.open(path) as f:
+            return f.read()
+
+    def test_copy(self):
+        with profile() as p:
+            version = self.icon.version_generate('large')
+        self.assertEqual(self.read(version.path), self.read(self.icon.path))
+        self.assertNotIn('decode', p.stages)
+        self.assertNotIn('encode', p.stages)
+
+    def test_metadata_removed(self):
+        exif = Image.Exif()
+        exif[0x010f] = 'Camera'
+        exif.get_ifd(0x8825)[2] = (48.0, 12.0, 30.0)  # GPSLatitude
+        Image.new('RGB', (100, 80), (255, 0, 0)).save(os.path.join(self.FOLDER_PATH, 'photo.jpg'), exif=exif)
+        photo = FileObject(os.path.join(self.F_FOLDER.path, 'photo.jpg'), site=site)
+        with profile() as p:
+            version = photo.version_generate('small')
+        self.assertIn('encode', p.stages)
+        with Image.open(os.path.join(settings.MEDIA_ROOT, version.path)) as im:
+            self.assertEqual(im.size, (100, 80))
+            self.assertNotIn('exif', im.info)
+            self.assertEqual(dict(im.getexif()), {})
+
+    def test_scaled(self):
+        Image.new('RGBA', (200, 150), (255, 0, 0, 128)).save(self.icon_path)
+        with profile() as p:
+            version = self.icon.version_generate('thumbnail')
+        self.assertNotEqual(self.read(version.path), self.read(self.icon.path))
+        self.assertIn('encode', p.stages)
+        with Image.open(os.path.join(settings.MEDIA_ROOT, version.path)) as im:
+            self.assertEqual(im.size, (60, 60))
+
+    def test_other_format(self):
+        version = self.icon.version_generate('large', {'format': 'webp'})
+        with Image.open(os.path.join(settings.MEDIA_ROOT, version.path)) as im:
+            self.assertEqual(im.format, 'WEBP')
+
+    def test_methods(self):
+        version = self.icon.version_generate('large', {'methods': [lambda im: im.rotate(90, expand=True)]})
+        with Image.open(os.path.join(settings.MEDIA_ROOT, version.path)) as im:
+            self.assertEqual(im.size, (30, 40))
+
+    @patch('filebrowser.utils.VERSION_PROCESSORS', [
+        'tests.test_versions.processor_watermark_in_place',
+        'filebrowser.utils.scale_and_crop',
+    ])
+    def test_processor_modifying_in_place(self):
+        utils._default_processors = None
+        self.addCleanup(setattr, utils, '_default_processors', None)
+        version = self.icon.version_generate('large')
+        self.assertNotEqual(self.read(version.path), self.read(self.icon.path))
+        with Image.open(os.path.join(settings.MEDIA_ROOT, version.path)) as im:
+            self.assertEqual(im.getpixel((0, 0)), (0, 0, 255, 255))
+            self.assertEqual(im.getpixel((20, 20)), (255, 0, 0, 128))
+
+    @patch('filebrowser.utils.VERSION_PROCESSORS', [
+        'tests.test_versions.processor_noop',
+        'filebrowser.utils.scale_and_crop',
+    ])
+    def test_custom_processor(self):
+        # only copied with the built-in processors (even if a custom processor is pure)
+        utils._default_processors = None
+        self.addCleanup(setattr, utils, '_default_processors', None)
+        with profile() as p:
+            self.icon.version_generate('large')
+        self.assertIn('encode', p.stages)
+
+    def test_reduced_original(self):
+        f, im = self.F_IMAGE._open_original([{'width': 60, 'height': 60}], decode=False)
+        self.assertTrue(self.F_IMAGE._may_copy_original(im, {'width': 1000}, '.jpg'))
+        f.close()
+        with patch('filebrowser.base.VERSION_MAX_PIXELS', 200000):
+            f, im = self.F_IMAGE._open_original([{'width': 250}], decode=False)
+        self.assertEqual(im.size, (500, 375))
+        self.assertFalse(self.F_IMAGE._may_copy_original(im, {'width': 500}, '.jpg'))
+        f.close()
+
+
+@patch('filebrowser.base.VERSION_CASCADE', True)
+class VersionCascadeTests(TestCase):
+
+    def setUp(self):
+        super(VersionCascadeTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.F_IMAGE.version_generate('large')
+
+    def generate(self, version_suffix):
+        fileobject = FileObject(self.F_IMAGE.path, site=site)
+        with patch.object(FileObject, '_open_original', autospec=True, side_effect=FileObject._open_original) as mock_open:
+            version = fileobject.version_generate(version_suffix)
+        with Image.open(os.path.join(settings.MEDIA_ROOT, version.path)) as im:
+            return im.size, mock_open.called
+
+    def test_from_larger_version(self):
+        size, opened_original = self.generate('small')
+        self.assertEqual(size[0], 140)
+        self.assertFalse(opened_original)
+
+    def test_crop(self):
+        self.assertEqual(self.generate('thumbnail'), ((60, 60), False))
+
+    @patch('filebrowser.base.VERSION_CASCADE_MIN_RATIO', 5)
+    def test_min_ratio(self):
+        self.assertTrue(self.generate('small')[1])
+
+    def test_modified_original(self):
+        os.utime(self.F_IMAGE.path_full, (0, time.time() + 10))
+        self.assertTrue(self.generate('small')[1])
+
+    def test_disabled(self):
+        with patch('filebrowser.base.VERSION_CASCADE', False):
+            self.assertTrue(self.generate('small')[1])
+
+
+class VersionsStorageTests(TestCase):
+
+    def setUp(self):
+        super(VersionsStorageTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+        self.VERSIONS_STORAGE_PATH = os.path.join(self.TEST_PATH, 'versions_storage')
+        site.versions_storage = FileSystemStorage(location=self.VERSIONS_STORAGE_PATH, base_url='https://cdn.example.com/')
+        self.addCleanup(setattr, site, 'versions_storage', None)
+        # manifests of the other storage
+        manifest._manifests.clear()
+
+    def test_fallback(self):
+        site.versions_storage = None
+        self.assertIs(site.versions_storage, site.storage)
+
+    def test_version_generate(self):
+        version = self.F_IMAGE.version_generate('small')
+        self.assertEqual(version.path, "_test/_versions/folder/testimage_small.jpg")
+        self.assertTrue(os.path.isfile(os.path.join(self.VERSIONS_STORAGE_PATH, version.path)))
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, version.path)))
+        self.assertEqual(version.url, "https://cdn.example.com/_test/_versions/folder/testimage_small.jpg")
+        self.assertEqual(version.width, 140)
+        self.assertIs(version.original.storage, site.storage)
+        # the existing version is found with the versions storage
+        with patch.object(FileObject, '_generate_version') as mock_generate:
+            FileObject(self.F_IMAGE.path, site=site).version_generate('small')
+        self.assertFalse(mock_generate.called)
+
+    def test_templatetag(self):
+        t = Template('{% load fb_versions %}{% version obj.path suffix %}')
+        r = t.render(Context({"obj": self.F_IMAGE, "suffix": "large"}))
+        self.assertEqual(r, "https://cdn.example.com/_test/_versions/folder/testimage_large.jpg")
+
+    @patch('filebrowser.base.VERSION_MANIFEST', True)
+    def test_manifest(self):
+        version = self.F_IMAGE.version_generate('small')
+        manifest_path = manifest.get_manifest_path(version.path)
+        self.assertTrue(os.path.isfile(os.path.join(self.VERSIONS_STORAGE_PATH, manifest_path)))
+
+    def test_delete_versions(self):
+        version = self.F_IMAGE.version_generate('small')
+        self.F_IMAGE.delete_versions()
+        self.assertFalse(os.path.exists(os.path.join(self.VERSIONS_STORAGE_PATH, version.path)))
+        self.assertTrue(self.F_IMAGE.exists)
+
+
+def burn_cpu(im):
+    while True:
+        pass
+
+
+def sleep_briefly(im):
+    time.sleep(1)
+    return im
+
+
+def sleep_forever(im):
+    while True:
+        time.sleep(1)
+
+
+@patch('filebrowser.base.VERSION_WORKERS', 1)
+@patch('filebrowser.workers.VERSION_WORKERS', 1)
+class VersionWorkersTests(TestCase):
+
+    def setUp(self):
+        super(VersionWorkersTests, self).setUp()
+        shutil.copy(self.STATIC_IMG_PATH, self.FOLDER_PATH)
+
+    def tearDown(self):
+        # wait for jobs still running (e.g. after a timeout)
+        workers.shutdown_pool(wait=True)
+        super(VersionWorkersTests, self).tearDown()
+
+    def generate(self, version_suffix, extra_options=None):
+        with profile() as p, patch('filebrowser.workers.metrics.increment') as mock_increment:
+            version = self.F_IMAGE.version_generate(version_suffix, extra_options)
+        results = [c[1]['result'] for c in mock_increment.call_args_list if c[0][0] == 'version_worker']
+        return version, results, p
+
+    def test_worker(self):
+        version, results, p = self.generate('small')
+        self.assertEqual(version.path, "_test/_versions/folder/testimage_small.jpg")
+        self.assertEqual(version.width, 140)
+        self.assertEqual(results, ['done'])
+        # decoded within the worker
+        self.assertNotIn('decode', p.stages)
+
+    def test_one_job(self):
+        worker = workers.get_pool()[0]
+        with patch.object(worker.executor, 'submit', wraps=worker.executor.submit) as mock_submit:
+            version, results, p = self.generate('small')
+            versions = self.F_IMAGE.versions_generate(['medium', 'big', 'large'], force=True)
+        # the original is opened and decoded once per job
+        self.assertEqual(mock_submit.call_count, 2)
+        self.assertEqual([version.width for version in versions], [300, 460, 680])
+
+    @patch('filebrowser.base.VERSION_MANIFEST', True)
+    def test_manifest(self):
+        manifest._manifests.clear()
+        with patch('filebrowser.manifest.update_manifest', wraps=manifest.update_manifest) as mock_update:
+            self.F_IMAGE.versions_generate(['small', 'large'])
+        # entries are returned by the worker and saved once
+        self.assertEqual(mock_update.call_count, 1)
+        manifest_path = manifest.get_manifest_path(self.F_IMAGE.version_path('small'))
+        self.assertEqual(sorted(manifest.get_manifest(site, manifest_path, refresh=True)), ['testimage_large.jpg', 'testimage_small.jpg'])
+
+    def test_start_method(self):
+        # a process with threads is not forked
+        self.assertIn(workers.get_context().get_start_method(), ('forkserver', 'spawn'))
+
+    @patch('filebrowser.workers.VERSION_WORKER_TIMEOUT', 0.2)
+    def test_timeout(self):
+        # started
+        workers.get_pool()[0].pid.result()
+        version, results, p = self.generate('small', {'methods': [sleep_briefly]})
+        self.assertEqual(results, ['timeout'])
+        # the running job is waited for (keeping the lock of the version)
+        self.assertEqual(version.path, "_test/_versions/folder/testimage_small.jpg")
+        self.assertTrue(os.path.isfile(version.path_full))
+
+    @patch('filebrowser.workers.VERSION_WORKER_TIMEOUT', 0.5)
+    @patch('filebrowser.workers.GRACE_PERIOD', 1)
+    def test_stuck(self):
+        # two workers (a class decorator can not be overridden)
+        with patch('filebrowser.workers.VERSION_WORKERS', 2):
+            pool = list(workers.get_pool())
+            for worker in pool:
+                worker.pid.result()
+            stuck = []
+            thread = threading.Thread(target=lambda: stuck.append(
+                FileObject(self.F_IMAGE.path, site=site).version_generate('small', {'methods': [sleep_forever]})))
+            thread.start()
+            while not any(worker.jobs for worker in pool):
+                time.sleep(0.01)
+            # the other worker is not affected
+            version, results, p = self.generate('medium')
+            self.assertEqual(version.path, "_test/_versions/folder/testimage_medium.jpg")
+            thread.join()
+            self.assertEqual(stuck[0].path, "")
+            # only the worker of the stuck job is killed and replaced
+            self.assertIsNot(workers.get_pool()[0], pool[0])
+            self.assertIs(workers.get_pool()[1], pool[1])
+            self.assertEqual(self.generate('big')[0].width, 460)
+
+    @patch('filebrowser.base.LQIP', True)
+    @patch('filebrowser.base.VERSION_ANALYZERS', ['filebrowser.utils.phash'])
+    def test_metadata(self):
+        caches['default'].clear()
+        version, results, p = self.generate('small')
+        self.assertEqual(results, ['done'])
+        # generated by the worker
+        self.assertNotIn('analyze', p.stages)
+        metadata = get_metadata(self.F_IMAGE)
+        self.assertTrue(metadata['lqip'].startswith('data:image/jpeg;base64,'))
+        self.assertTrue(metadata['phash'])
+        with patch('filebrowser.base.open_source') as mock_open:
+            self.assertEqual(FileObject(self.F_IMAGE.path, site=site).lqip, metadata['lqip'])
+        self.assertFalse(mock_open.called)
+
+    @patch('filebrowser.workers.VERSION_WORKER_CPU_LIMIT', 1)
+    def test_cpu_limit(self):
+        worker = workers.get_pool()[0]
+        version, results, p = self.generate('small', {'methods': [burn_cpu]})
+        self.assertEqual(version.path, "")
+        self.assertEqual(results, ['failed'])
+        # the dead worker is replaced
+        self.assertIsNot(workers.get_pool()[0], worker)
+        version, results, p = self.generate('medium')
+        self.assertEqual(results, ['done'])
+
+    def test_not_picklable(self):
+        version, results, p = self.generate('small', {'methods': [lambda im: im]})
+        self.assertEqual(version.width, 140)
+        self.assertEqual(results, [])
+        self.assertIn('decode', p.stages)